@@ -13,8 +13,25 @@ from .models import PeltonColeCole
 from .models import Dias2000
 from .models import Shin2015
 from .plotlib import plotlib
+from .plotlib import save_reports
 from .test import run_test
+from .test import run_regression
+from .test import run_distributed_test
+from .test import run_service_test
 from .data import DataFiles
+from .moves import LinearGibbsMove
+from .moves import DelayedAcceptanceMove
+from .moves import SnookerMove
+from .moves import benchmark_moves
+from .service import InversionService
+from .surrogate import ForwardSurrogate
+from .distributed import Coordinator
+from .distributed import Worker
+from .distributed import SQLiteTransport
+from .compiled import build_model
+from .synthetic import make_spectra
+from .archive import Archive
+from .archive import ArchiveWriter
 
 
 __all__ = (
@@ -24,6 +41,23 @@ __all__ = (
     'Dias2000',
     'Shin2015',
     'plotlib',
+    'save_reports',
     'run_test',
+    'run_regression',
+    'run_distributed_test',
+    'run_service_test',
     'DataFiles',
+    'LinearGibbsMove',
+    'DelayedAcceptanceMove',
+    'SnookerMove',
+    'benchmark_moves',
+    'InversionService',
+    'ForwardSurrogate',
+    'Coordinator',
+    'Worker',
+    'SQLiteTransport',
+    'build_model',
+    'make_spectra',
+    'Archive',
+    'ArchiveWriter',
 )
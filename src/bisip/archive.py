@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author: charles
+# @Date:   2026-10-19
+# @Email:  charles@goldspot.ca
+# @Last modified by:   charles
+# @Last modified time: 2026-10-19
+
+
+import json
+import struct
+import sys
+
+import emcee
+import numpy as np
+
+from . import models
+
+
+MAGIC = b'BISIPAR1'
+COLUMNS = ('freq', 'amp', 'pha', 'amp_err', 'pha_err')
+_ALIGN = 64
+
+
+def _to_json(o):
+    """Converts the numpy values of the index to JSON types. """
+    if isinstance(o, (np.generic, np.ndarray)):
+        return o.tolist()
+    raise TypeError(f'Cannot archive a {type(o).__name__}')
+
+
+class StoredChain(object):
+    """A read-only chain standing in for the `emcee` sampler of a model.
+
+    Args:
+        chain (:obj:`ndarray`): The stored chain, with shape (nsteps,
+            nwalkers, ndim). It is usually memory-mapped.
+        acceptance_fraction (:obj:`ndarray`): The acceptance fraction of
+            every walker during the original fit. Defaults to None.
+
+    """
+
+    def __init__(self, chain, acceptance_fraction=None):
+        self.chain = chain
+        self.acceptance_fraction = acceptance_fraction
+        self.iteration = chain.shape[0]
+
+    def get_chain(self, discard=0, thin=1, flat=False):
+        """Gets the stored chain, like `emcee.EnsembleSampler.get_chain`. """
+        chain = self.chain[discard+thin-1::thin]
+        if flat:
+            chain = chain.reshape(-1, chain.shape[-1])
+        return chain
+
+    def get_autocorr_time(self, discard=0, thin=1, **kwargs):
+        """Estimates the integrated autocorrelation time of the stored
+        chain, like `emcee.EnsembleSampler.get_autocorr_time`. """
+        x = self.get_chain(discard=discard, thin=thin)
+        return thin*emcee.autocorr.integrated_time(x, **kwargs)
+
+
+class ArchiveWriter(object):
+    """Writes spectra and inversion results to a single archive file.
+
+    The archive holds the spectra as columns (freq, amp, pha, amp_err,
+    pha_err) concatenated over all spectra, the configuration of the fitted
+    models and their thinned posterior chains as raw, aligned arrays, and a
+    JSON index at the end of the file. The chains are written as they are
+    added, while the spectra are buffered and written when the archive is
+    closed. Use it as a context manager, or call `close` when done.
+
+    Example:
+        Archiving fitted models::
+
+            with ArchiveWriter('results.bsp') as archive:
+                for name, model in fitted.items():
+                    archive.add_model(name, model, discard=1000, thin=10)
+
+    Args:
+        path (:obj:`str`): The path to the archive file. An existing file is
+            overwritten.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._f = open(path, 'wb')
+        self._f.write(MAGIC)
+        self._columns = {c: [] for c in COLUMNS}
+        self._n_rows = 0
+        self._spectra = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write_array(self, a):
+        """Writes an aligned array and returns its location in the file. """
+        a = np.ascontiguousarray(a)
+        pad = -self._f.tell() % _ALIGN
+        self._f.write(b'\0'*pad)
+        offset = self._f.tell()
+        self._f.write(a.tobytes())
+        return {'offset': offset, 'dtype': a.dtype.str, 'shape': a.shape}
+
+    def add_spectrum(self, spectrum_id, data, ph_units='mrad'):
+        """Adds a spectrum.
+
+        Args:
+            spectrum_id (:obj:`str`): The spectrum ID.
+            data (:obj:`ndarray`): An array with the same columns as the data
+                files (freq, amp, pha, amp_err, pha_err).
+            ph_units (:obj:`str`): The units of the phase shift measurements.
+                Defaults to 'mrad'.
+
+        """
+        spectrum_id = str(spectrum_id)
+        if spectrum_id in self._spectra:
+            raise ValueError(f'Duplicate spectrum ID: {spectrum_id}')
+        data = np.asarray(data, dtype=float)
+        for i, c in enumerate(COLUMNS):
+            self._columns[c].append(data[:, i])
+        self._spectra[spectrum_id] = {'start': self._n_rows,
+                                      'length': data.shape[0],
+                                      'ph_units': ph_units,
+                                      'config': None,
+                                      'chain': None,
+                                      }
+        self._n_rows += data.shape[0]
+
+    def add_spectra(self, spectrum_ids, data, ph_units='mrad'):
+        """Adds stacked spectra, e.g. the output of `synthetic.make_spectra`.
+
+        Args:
+            spectrum_ids (:obj:`list`): The spectrum IDs.
+            data (:obj:`ndarray`): An array with shape (n, N, 5).
+            ph_units (:obj:`str`): The units of the phase shift measurements.
+                Defaults to 'mrad'.
+
+        """
+        for spectrum_id, d in zip(spectrum_ids, data):
+            self.add_spectrum(spectrum_id, d, ph_units)
+
+    def add_model(self, spectrum_id, model, discard=None, thin=1):
+        """Adds a fitted model, its spectrum and its thinned chain.
+
+        Args:
+            spectrum_id (:obj:`str`): The spectrum ID.
+            model (:obj:`Inversion`): The fitted model.
+            discard (:obj:`int`): Number of steps to discard (burn-in period)
+                before storing the chain. If None, half of the steps are
+                discarded. Defaults to None.
+            thin (:obj:`int`): Thinning factor of the stored chain. Defaults
+                to 1.
+
+        """
+        spectrum_id = str(spectrum_id)
+        if spectrum_id not in self._spectra:
+            data = model.filepath
+            if not isinstance(data, np.ndarray):
+                data = np.loadtxt(data, skiprows=model.headers, delimiter=',')
+            self.add_spectrum(spectrum_id, data, model.ph_units)
+        if discard is None:
+            discard = model.nsteps // 2
+        entry = self._spectra[spectrum_id]
+        entry['config'] = model.get_config()
+        entry['config'].update({'discard': discard, 'thin': thin})
+        entry['chain'] = self._write_array(
+            model.get_chain(discard=discard, thin=thin).astype(float))
+        entry['acceptance_fraction'] = list(
+            map(float, model.sampler.acceptance_fraction))
+        entry['fit_time'] = getattr(model, '_fit_time', None)
+
+    def close(self):
+        """Writes the spectra and the index, and closes the file. """
+        if self._f.closed:
+            return
+        columns = {c: self._write_array(np.concatenate(v) if v
+                                        else np.empty(0))
+                   for c, v in self._columns.items()}
+        index = json.dumps({'version': 1,
+                            'columns': columns,
+                            'spectra': self._spectra,
+                            }, default=_to_json).encode()
+        self._f.write(index)
+        self._f.write(struct.pack('<Q', len(index)))
+        self._f.write(MAGIC)
+        self._f.close()
+
+
+class Archive(object):
+    """Reads an archive written by `ArchiveWriter`.
+
+    The file is memory-mapped, so opening it only reads its index, and the
+    spectra and chains are read from disk when they are accessed.
+
+    Example:
+        Plotting the results of an archived inversion::
+
+            archive = Archive('results.bsp')
+            model = archive.load_model('SIP-K389175')
+            model.plot_fit()
+            model.get_param_mean(discard=0)
+
+    Args:
+        path (:obj:`str`): The path to the archive file.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._mm = np.memmap(path, dtype=np.uint8, mode='r')
+        trailer = self._mm[-16:].tobytes()
+        if trailer[8:] != MAGIC or self._mm[:8].tobytes() != MAGIC:
+            raise ValueError(f'Not a bisip archive: {path}')
+        size = struct.unpack('<Q', trailer[:8])[0]
+        index = json.loads(self._mm[-16-size:-16].tobytes())
+        self._columns = {c: self._array(v)
+                         for c, v in index['columns'].items()}
+        self._spectra = index['spectra']
+
+    def _array(self, location):
+        return np.ndarray(tuple(location['shape']), location['dtype'],
+                          buffer=self._mm, offset=location['offset'])
+
+    @property
+    def ids(self):
+        """:obj:`list` of :obj:`str`: The IDs of the archived spectra."""
+        return list(self._spectra)
+
+    def __len__(self):
+        return len(self._spectra)
+
+    def __contains__(self, spectrum_id):
+        return str(spectrum_id) in self._spectra
+
+    def __iter__(self):
+        return iter(self._spectra)
+
+    def get_data(self, spectrum_id):
+        """Gets a spectrum.
+
+        Args:
+            spectrum_id (:obj:`str`): The spectrum ID.
+
+        Returns:
+            :obj:`ndarray`: An array with the same columns as the data files
+            (freq, amp, pha, amp_err, pha_err).
+
+        """
+        entry = self._spectra[str(spectrum_id)]
+        rows = slice(entry['start'], entry['start'] + entry['length'])
+        return np.column_stack([self._columns[c][rows] for c in COLUMNS])
+
+    def get_config(self, spectrum_id):
+        """Gets the configuration of an archived model, or None. """
+        return self._spectra[str(spectrum_id)]['config']
+
+    def get_chain(self, spectrum_id, flat=False):
+        """Gets an archived chain without reading it into memory.
+
+        Args:
+            spectrum_id (:obj:`str`): The spectrum ID.
+            flat (:obj:`bool`): Whether or not to flatten the walkers.
+                Defaults to False.
+
+        Returns:
+            :obj:`ndarray`: The memory-mapped chain, already discarded and
+            thinned, with shape (nsteps, nwalkers, ndim), or None if no model
+            was archived for this spectrum.
+
+        """
+        entry = self._spectra[str(spectrum_id)]
+        if entry['chain'] is None:
+            return None
+        chain = self._array(entry['chain'])
+        if flat:
+            chain = chain.reshape(-1, chain.shape[-1])
+        return chain
+
+    def load_model(self, spectrum_id, model=None, **kwargs):
+        """Rebuilds an archived model.
+
+        If a chain was archived for this spectrum, it is attached to the
+        model, which can then be used as if it were fitted, including its
+        diagnostics. The chain is already discarded and thinned, so pass
+        `discard=0` to the statistics methods.
+
+        Args:
+            spectrum_id (:obj:`str`): The spectrum ID.
+            model (:obj:`type`): The model class to use for spectra archived
+                without a model, or to override the archived one. Models
+                built with `compiled.build_model` must be built again before
+                they are loaded. Defaults to None.
+            **kwargs: Keyword arguments passed to the model class, which
+                override the archived ones.
+
+        Returns:
+            :obj:`Inversion`: The model.
+
+        """
+        entry = self._spectra[str(spectrum_id)]
+        config = entry['config'] or {}
+        if model is None:
+            if not config:
+                raise ValueError('No model archived for this spectrum. Pass '
+                                 'a model class.')
+            model = getattr(models, config['model'], None)
+            if model is None:
+                model = getattr(sys.modules.get('bisip.compiled'),
+                                config['model'], None)
+            if model is None:
+                raise ValueError(f"Unknown model: {config['model']}")
+        model_kwargs = dict(config.get('model_kwargs', {}),
+                            ph_units=entry['ph_units'],
+                            seed=config.get('seed'))
+        model_kwargs.update(kwargs)
+        inv = model(self.get_data(spectrum_id), **model_kwargs)
+        if config.get('params') and type(inv).__name__ == config['model']:
+            inv.params.update(config['params'])
+        if entry['chain'] is not None:
+            acceptance = entry.get('acceptance_fraction')
+            inv._set_chain(StoredChain(
+                self.get_chain(spectrum_id),
+                None if acceptance is None else np.array(acceptance)))
+            fit_time = entry.get('fit_time')
+            inv._fit_time = np.nan if fit_time is None else fit_time
+        return inv
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author: charles
+# @Date:   2026-10-19
+# @Email:  charles@goldspot.ca
+# @Last modified by:   charles
+# @Last modified time: 2026-10-19
+
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+# Process-wide LRU cache of the frequency-dependent precomputations. Every
+# worker process fills its own copy, unless it is forked after the grids
+# were computed, in which case it inherits them without copying since its
+# arrays are read-only.
+_grids = OrderedDict()
+
+# Number of grids kept in the cache
+_MAX_GRIDS = 64
+
+# Number of relaxation times per block when projecting the kernel
+_BLOCK = 1024
+
+
+def _read_only(**arrays):
+    for v in arrays.values():
+        v.setflags(write=False)
+    return arrays
+
+
+def decomposition_grid(w, poly_deg, c_exp, n_tau=None):
+    """Gets the relaxation time grid and basis of a decomposition scheme.
+
+    The grid only depends on the angular frequencies and on the decomposition
+    hyperparameters, so it is computed once per process and shared by every
+    PolynomialDecomposition instance using the same frequencies. The least
+    recently used grids are dropped once more than 64 are cached. The Debye
+    kernel is projected on the polynomial basis in blocks of relaxation
+    times, so that the full kernel is never held in memory and evaluating
+    the impedance only costs a (2N, poly_deg+1) matrix product, whatever the
+    size of the grid. The returned arrays are read-only.
+
+    Args:
+        w (:obj:`ndarray`): Array of angular frequencies (w = 2*pi*f).
+        poly_deg (:obj:`int`): The polynomial degree of the decomposition.
+        c_exp (:obj:`float`): The c-exponent of the decomposition.
+        n_tau (:obj:`int`): The number of relaxation times in the grid. If
+            None, twice the number of frequencies is used. Defaults to None.
+
+    Returns:
+        :obj:`dict`: A dict holding the log10 relaxation times (`log_tau`),
+        their powers up to `poly_deg` (`log_taus`), the relaxation times
+        (`taus`) and the C-contiguous real basis (`basis`) with shape
+        (2N, poly_deg+1), such that the stacked real and imaginary parts of
+        the impedance are R0*(e - basis @ a), where e is 1 for the real parts
+        and 0 for the imaginary parts.
+
+    """
+    w = np.ascontiguousarray(w, dtype=float)
+    if n_tau is None:
+        n_tau = 2*w.shape[0]
+    key = (w.tobytes(), int(poly_deg), float(c_exp), int(n_tau))
+    if key in _grids:
+        _grids.move_to_end(key)
+    else:
+        # Define a range of relaxation time values for the RTD
+        min_tau = np.floor(min(np.log10(1./w)) - 1)
+        max_tau = np.floor(max(np.log10(1./w)) + 1)
+        log_tau = np.linspace(min_tau, max_tau, n_tau)
+
+        # Precompute the log_tau_i**i values for the polynomial approximation
+        log_taus = np.array([log_tau**i for i in range(poly_deg+1)])
+        taus = 10**log_tau
+
+        basis = np.zeros((2*w.shape[0], poly_deg+1))
+        for i in range(0, n_tau, _BLOCK):
+            K = debye_kernel(w, taus[i:i+_BLOCK], c_exp)
+            basis += np.vstack([K.real, K.imag]) @ log_taus[:, i:i+_BLOCK].T
+        _grids[key] = _read_only(log_tau=log_tau, log_taus=log_taus,
+                                 taus=taus, basis=basis)
+        if len(_grids) > _MAX_GRIDS:
+            _grids.popitem(last=False)
+    return _grids[key]
+
+
+def debye_kernel(w, taus, c_exp):
+    """Returns the complex Debye kernel of a relaxation time grid.
+
+    Args:
+        w (:obj:`ndarray`): Array of angular frequencies (w = 2*pi*f).
+        taus (:obj:`ndarray`): The relaxation times.
+        c_exp (:obj:`float`): The c-exponent of the decomposition.
+
+    Returns:
+        :obj:`ndarray`: The kernel, with shape (N, n_tau), such that the
+        impedance is R0*(1 - kernel @ RTD).
+
+    """
+    return 1 - 1/(1 + (1j*np.outer(w, taus))**c_exp)
+
+
+def clear_cache():
+    """Clears the process-wide cache of precomputed grids. """
+    _grids.clear()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author: charles
+# @Date:   2026-10-19
+# @Email:  charles@goldspot.ca
+# @Last modified by:   charles
+# @Last modified time: 2026-10-19
+
+
+from .compiled import build_model
+
+
+class Element(object):
+    """An abstract equivalent circuit element.
+
+    Elements are combined in series with the `+` operator (or the Series
+    class) and in parallel with the `|` operator (or the Parallel class). A
+    circuit is turned into an inversion model with the build method, which
+    fuses the impedance of the whole circuit into a single compiled kernel
+    (see `compiled.build_model`).
+
+    Args:
+        suffix (:obj:`str`): Appended to the parameter names of the element
+            to make them unique in a circuit, e.g. '1' for R1. Defaults to ''.
+        **bounds: Parameter bounds overriding the default ones, keyed by the
+            parameter names without suffix, e.g. ``R=[0.5, 1.5]``.
+
+    """
+
+    # Default parameter bounds and impedance template, set by subclasses
+    defaults = {}
+    template = ''
+
+    def __init__(self, suffix='', **bounds):
+        for p in bounds:
+            if p not in self.defaults:
+                raise ValueError(f'Unknown parameter of {type(self).__name__}'
+                                 f': {p}')
+        self._names = {p: f'{p}{suffix}' for p in self.defaults}
+        self._params = {self._names[p]: list(bounds.get(p, b))
+                        for p, b in self.defaults.items()}
+
+    @property
+    def params(self):
+        """:obj:`dict`: Parameter names and their bounds."""
+        return self._params
+
+    @property
+    def expression(self):
+        """:obj:`str`: The impedance expression of the element."""
+        return self.template.format(**self._names)
+
+    def __add__(self, other):
+        return Series(self, other)
+
+    def __or__(self, other):
+        return Parallel(self, other)
+
+    def build(self, name, **kwargs):
+        """Builds an inversion model class from the circuit.
+
+        Args:
+            name (:obj:`str`): The name of the model class.
+            **kwargs: Additional keyword arguments passed to
+                `compiled.build_model` (jit, cache_dir).
+
+        Returns:
+            :obj:`type`: A subclass of Inversion.
+
+        """
+        return build_model(name, self.params, self.expression, **kwargs)
+
+
+class R(Element):
+    """A resistor. Parameter: R. """
+    defaults = {'R': [0.0, 1.0]}
+    template = '{R}'
+
+
+class C(Element):
+    """A capacitor. Parameter: log_C, the natural log of the capacitance. """
+    defaults = {'log_C': [-20.0, 0.0]}
+    template = '1/(1j*w*exp({log_C}))'
+
+
+class CPE(Element):
+    """A constant phase element. Parameters: log_Q (natural log) and n. """
+    defaults = {'log_Q': [-20.0, 0.0], 'n': [0.0, 1.0]}
+    template = '1/(exp({log_Q})*(1j*w)**{n})'
+
+
+class Warburg(Element):
+    """A semi-infinite Warburg element. Parameter: log_A (natural log). """
+    defaults = {'log_A': [-10.0, 5.0]}
+    template = 'exp({log_A})/sqrt(1j*w)'
+
+
+class ColeCole(Element):
+    """A Pelton Cole-Cole element. Parameters: R, m, log_tau and c. """
+    defaults = {'R': [0.0, 2.0], 'm': [0.0, 1.0], 'log_tau': [-15.0, 5.0],
+                'c': [0.0, 1.0]}
+    template = '{R}*(1 - {m}*(1 - 1/(1 + (1j*w*exp({log_tau}))**{c})))'
+
+
+class _Composite(Element):
+    """An abstract combination of circuit elements. """
+
+    def __init__(self, *elements):
+        self.elements = []
+        for e in elements:
+            # Flatten nested combinations of the same kind
+            if type(e) is type(self):
+                self.elements.extend(e.elements)
+            else:
+                self.elements.append(e)
+        self._params = {}
+        for e in self.elements:
+            for p, b in e.params.items():
+                if p in self._params:
+                    raise ValueError(f'Duplicate parameter name: {p}. Pass '
+                                     'a different suffix to the elements.')
+                self._params[p] = b
+
+
+class Series(_Composite):
+    """Circuit elements connected in series.
+
+    Args:
+        *elements (:obj:`Element`): The elements to connect.
+
+    """
+
+    @property
+    def expression(self):
+        return '(' + ' + '.join(e.expression for e in self.elements) + ')'
+
+
+class Parallel(_Composite):
+    """Circuit elements connected in parallel.
+
+    Args:
+        *elements (:obj:`Element`): The elements to connect.
+
+    """
+
+    @property
+    def expression(self):
+        terms = ' + '.join(f'1/({e.expression})' for e in self.elements)
+        return f'1/({terms})'
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author: charles
+# @Date:   2026-10-19
+# @Email:  charles@goldspot.ca
+# @Last modified by:   charles
+# @Last modified time: 2026-10-19
+
+
+import hashlib
+import importlib.util
+import keyword
+import os
+import sys
+
+import numpy as np
+
+from .models import Inversion
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+# Functions available in the impedance expressions
+FUNCTIONS = ('exp', 'log', 'log10', 'sqrt', 'sin', 'cos', 'tan', 'tanh',
+             'arctan', 'pi')
+
+_TEMPLATE = '''# Generated by bisip.compiled.build_model. Do not edit.
+import numpy as np
+from numpy import {functions}
+{header}
+
+{decorator}
+def kernel(_thetas, _freqs):
+    _n = _thetas.shape[0]
+    _N = _freqs.shape[0]
+    _Z = np.empty((_n, 2, _N))
+    for _i in range(_n):
+{unpack}
+        for _k in range(_N):
+            w = _freqs[_k]
+            _z = {expression}
+            _Z[_i, 0, _k] = _z.real
+            _Z[_i, 1, _k] = _z.imag
+    return _Z
+
+
+def kernel_numpy(_thetas, _freqs):
+{unpack_numpy}
+    w = _freqs[None, :]
+    _z = {expression} + 0j*w
+    return np.stack([_z.real, _z.imag], axis=1)
+'''
+
+
+def _cache_dir():
+    return os.environ.get('BISIP_CACHE_DIR',
+                          os.path.join(os.path.expanduser('~'), '.cache',
+                                       'bisip'))
+
+
+def _generate_source(params, expression, jit):
+    names = list(params)
+    unpack = '\n'.join(f'        {p} = _thetas[_i, {i}]'
+                       for i, p in enumerate(names))
+    unpack_numpy = '\n'.join(f'    {p} = _thetas[:, {i}:{i+1}]'
+                             for i, p in enumerate(names))
+    if jit:
+        header = 'import numba'
+        decorator = '@numba.njit(cache=True)'
+    else:
+        header = decorator = ''
+    return _TEMPLATE.format(functions=', '.join(FUNCTIONS), header=header,
+                            decorator=decorator, unpack=unpack,
+                            unpack_numpy=unpack_numpy, expression=expression)
+
+
+def _load_kernels(params, expression, jit, cache_dir):
+    """Writes the kernel source to the cache and imports it. """
+    source = _generate_source(params, expression, jit)
+    version = numba.__version__ if jit else 'numpy'
+    key = hashlib.sha256((source + version).encode()).hexdigest()[:16]
+    module_name = f'bisip_kernel_{key}'
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+
+    cache_dir = cache_dir or _cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f'{module_name}.py')
+    if not os.path.exists(path):
+        tmp = f'{path}.{os.getpid()}'
+        with open(tmp, 'w') as f:
+            f.write(source)
+        os.replace(tmp, path)
+
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sys.modules[module_name] = module
+    return module
+
+
+def _check_kernels(module, bounds, n=8):
+    """Checks that the compiled kernel agrees with the numpy kernel. """
+    rng = np.random.default_rng(0)
+    lo, hi = np.array(list(bounds.values()), dtype=float).T
+    thetas = rng.uniform(lo, hi, (n, lo.shape[0]))
+    freqs = 2*np.pi*np.geomspace(1e-2, 1e4, 16)
+    with np.errstate(all='ignore'):
+        Z_jit = module.kernel(thetas, freqs)
+        Z_np = module.kernel_numpy(thetas, freqs)
+    if not np.allclose(Z_jit, Z_np, rtol=1e-8, atol=1e-10, equal_nan=True):
+        raise RuntimeError('The compiled kernel disagrees with the numpy '
+                           'kernel. Check the impedance expression.')
+
+
+def build_model(name, params, expression, jit=None, cache_dir=None):
+    """Builds an inversion model class from an impedance expression.
+
+    The expression gives the complex impedance (normalized like the data)
+    as a function of the angular frequency `w` and of the parameters. It is
+    written with Python operators, the imaginary unit `1j` and the functions
+    listed in `FUNCTIONS`. A kernel evaluating it for all parameter vectors
+    and frequencies is generated, written to an on-disk cache keyed by the
+    hash of its source, and compiled with numba if it is installed. The
+    compiled artifacts are cached on disk by numba, so later sessions skip
+    the compilation. Without numba, the expression is evaluated with
+    vectorized numpy operations instead.
+
+    Example:
+        Fitting a single Cole-Cole relaxation::
+
+            ColeCole = build_model(
+                'ColeCole',
+                {'r0': [0.9, 1.1], 'm': [0, 1], 'log_tau': [-15, 5],
+                 'c': [0, 1]},
+                'r0*(1 - m*(1 - 1/(1 + (1j*w*exp(log_tau))**c)))')
+            model = ColeCole(filepath)
+            model.fit(vectorize=True)
+
+    Args:
+        name (:obj:`str`): The name of the model class.
+        params (:obj:`dict`): Ordered parameter names and their bounds. The
+            names must be valid Python identifiers, which are not keywords
+            and do not start with an underscore.
+        expression (:obj:`str`): The impedance expression.
+        jit (:obj:`bool`): Whether to compile the kernel with numba. If None,
+            numba is used if it is installed. Defaults to None.
+        cache_dir (:obj:`str`): The directory in which the kernels are
+            cached. If None, the BISIP_CACHE_DIR environment variable or
+            ~/.cache/bisip is used. Defaults to None.
+
+    Returns:
+        :obj:`type`: A subclass of Inversion, to instantiate like the other
+        models.
+
+    """
+    if jit is None:
+        jit = numba is not None
+    if jit and numba is None:
+        raise ImportError('The numba package is required to compile models. '
+                          'Install it with `conda install numba`')
+    existing = getattr(sys.modules[__name__], name, None)
+    if existing is not None and not hasattr(existing, 'expression'):
+        raise ValueError(f'Invalid model name: {name}')
+    for p in params:
+        if (not p.isidentifier() or keyword.iskeyword(p) or p.startswith('_')
+                or p in FUNCTIONS or p in ('w', 'np')):
+            raise ValueError(f'Invalid parameter name: {p}')
+
+    module = _load_kernels(params, expression, jit, cache_dir)
+    bounds = {k: list(v) for k, v in params.items()}
+    if jit:
+        _check_kernels(module, bounds)
+    kernel = module.kernel if jit else module.kernel_numpy
+
+    def __init__(self, *args, **kwargs):
+        Inversion.__init__(self, *args, **kwargs)
+        self.params.update({k: list(v) for k, v in bounds.items()})
+
+    def forward(self, theta, w):
+        return kernel(np.ascontiguousarray(theta, dtype=float)[None], w)[0]
+
+    def forward_batch(self, thetas, w):
+        return kernel(np.ascontiguousarray(thetas, dtype=float), w)
+
+    doc = (f'A {name} inversion scheme built from the impedance expression '
+           f'``{expression}``.')
+    cls = type(name, (Inversion,), {'__init__': __init__,
+                                    'forward': forward,
+                                    'forward_batch': forward_batch,
+                                    'expression': expression,
+                                    '__doc__': doc,
+                                    })
+    # Register the class so that its instances can be pickled
+    cls.__module__ = __name__
+    setattr(sys.modules[__name__], name, cls)
+    return cls
@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author: charles
+# @Date:   2026-10-19
+# @Email:  charles@goldspot.ca
+# @Last modified by:   charles
+# @Last modified time: 2026-10-19
+
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+
+from . import models
+from .utils import seed_sequence, spectrum_seed
+
+
+class Transport(object):
+    """The interface between a Coordinator and its Workers.
+
+    Subclass it to distribute the inversions over another medium (e.g. a
+    message broker or a web service). Tasks are identified by a spectrum ID
+    and hold a JSON-serializable payload.
+
+    """
+
+    def put(self, tasks):
+        """Adds tasks, given as a dict of payloads keyed by spectrum ID. """
+        raise NotImplementedError
+
+    def claim(self, worker_id):
+        """Assigns a pending task to a worker.
+
+        Returns:
+            :obj:`tuple`: The spectrum ID and payload, or None if no task is
+            pending.
+
+        """
+        raise NotImplementedError
+
+    def heartbeat(self, task_id, worker_id):
+        """Signals that a worker is still processing a task. """
+        raise NotImplementedError
+
+    def complete(self, task_id, worker_id, result):
+        """Stores the result of a task processed by a worker. """
+        raise NotImplementedError
+
+    def fail(self, task_id, worker_id, error):
+        """Reports a task that could not be processed by a worker. """
+        raise NotImplementedError
+
+    def requeue(self, heartbeat_timeout, max_attempts):
+        """Requeues failed tasks and tasks with a stale heartbeat.
+
+        Tasks with a stale heartbeat that were attempted `max_attempts` times
+        are marked as failed instead, so that they are not left running.
+
+        Returns:
+            :obj:`int`: The number of requeued tasks.
+
+        """
+        raise NotImplementedError
+
+    def counts(self):
+        """Returns the number of tasks in each status. """
+        raise NotImplementedError
+
+    def results(self):
+        """Returns the results of the completed tasks, keyed by ID. """
+        raise NotImplementedError
+
+
+class SQLiteTransport(Transport):
+    """A work queue stored in a SQLite database file.
+
+    This is the default local backend. Any number of worker processes on the
+    same machine (or sharing the file over a file system with working locks)
+    can use it at once.
+
+    Args:
+        path (:obj:`str`): The path to the database file. It is created if it
+            does not exist.
+        timeout (:obj:`float`): How long to wait for a lock on the database,
+            in seconds. Defaults to 30.
+
+    """
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        with self._connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS tasks ('
+                       'id TEXT PRIMARY KEY, '
+                       'payload TEXT, '
+                       "status TEXT DEFAULT 'pending', "
+                       'worker TEXT, '
+                       'heartbeat REAL, '
+                       'attempts INTEGER DEFAULT 0, '
+                       'result TEXT, '
+                       'error TEXT)')
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=self.timeout,
+                             isolation_level=None)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def put(self, tasks):
+        with self._connect() as db:
+            db.execute('BEGIN IMMEDIATE')
+            db.executemany('INSERT OR REPLACE INTO tasks (id, payload) '
+                           'VALUES (?, ?)',
+                           [(str(k), json.dumps(v)) for k, v in tasks.items()])
+            db.execute('COMMIT')
+
+    def claim(self, worker_id):
+        with self._connect() as db:
+            db.execute('BEGIN IMMEDIATE')
+            row = db.execute("SELECT id, payload FROM tasks "
+                             "WHERE status = 'pending' LIMIT 1").fetchone()
+            if row is not None:
+                db.execute("UPDATE tasks SET status = 'running', worker = ?, "
+                           "heartbeat = ?, attempts = attempts + 1 "
+                           "WHERE id = ?", (worker_id, time.time(), row[0]))
+            db.execute('COMMIT')
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def heartbeat(self, task_id, worker_id):
+        with self._connect() as db:
+            db.execute("UPDATE tasks SET heartbeat = ? WHERE id = ? AND "
+                       "worker = ? AND status = 'running'",
+                       (time.time(), task_id, worker_id))
+
+    def complete(self, task_id, worker_id, result):
+        with self._connect() as db:
+            db.execute("UPDATE tasks SET status = 'done', result = ? "
+                       "WHERE id = ? AND worker = ? AND status = 'running'",
+                       (json.dumps(result), task_id, worker_id))
+
+    def fail(self, task_id, worker_id, error):
+        with self._connect() as db:
+            db.execute("UPDATE tasks SET status = 'failed', error = ? "
+                       "WHERE id = ? AND worker = ? AND status = 'running'",
+                       (error, task_id, worker_id))
+
+    def requeue(self, heartbeat_timeout, max_attempts):
+        stale = time.time() - heartbeat_timeout
+        with self._connect() as db:
+            db.execute('BEGIN IMMEDIATE')
+            cur = db.execute(
+                "UPDATE tasks SET status = 'pending', worker = NULL "
+                "WHERE attempts < ? AND (status = 'failed' OR "
+                "(status = 'running' AND heartbeat < ?))",
+                (max_attempts, stale))
+            n = cur.rowcount
+            # Lost tasks without attempts left are failed for good
+            db.execute("UPDATE tasks SET status = 'failed', worker = NULL, "
+                       "error = 'Heartbeat timeout' "
+                       "WHERE status = 'running' AND heartbeat < ? "
+                       "AND attempts >= ?", (stale, max_attempts))
+            db.execute('COMMIT')
+        return n
+
+    def counts(self):
+        with self._connect() as db:
+            rows = db.execute('SELECT status, COUNT(*) FROM tasks '
+                              'GROUP BY status').fetchall()
+        return dict(rows)
+
+    def results(self):
+        with self._connect() as db:
+            rows = db.execute("SELECT id, result FROM tasks "
+                              "WHERE status = 'done'").fetchall()
+        return {k: json.loads(v) for k, v in rows}
+
+
+def fit_task(task_id, payload):
+    """Fits the spectrum described by a task payload.
+
+    This is the default task function of the Worker class.
+
+    Args:
+        task_id (:obj:`str`): The spectrum ID.
+        payload (:obj:`dict`): A dict holding either the path to the data file
+            (`filepath`) or the data table (`data`), the name of the model
+            class (`model`), and optionally the keyword arguments of the model
+            (`model_kwargs`) and of the fit method (`fit_kwargs`), the
+            number of burn-in steps to discard from the summary (`discard`)
+            and the random seed of the model (`seed`).
+
+    Returns:
+        :obj:`dict`: The parameter names, means and standard deviations, the
+        mean acceptance fraction and the random seed.
+
+    """
+    source = payload.get('filepath')
+    if source is None:
+        source = np.array(payload['data'], dtype=float)
+    model = getattr(models, payload['model'])(
+        source, seed=payload.get('seed'), **payload.get('model_kwargs', {}))
+    model.fit(progress=False, **payload.get('fit_kwargs', {}))
+    discard = payload.get('discard', model.nsteps // 2)
+    return {'param_names': model.param_names,
+            'mean': model.get_param_mean(discard=discard).tolist(),
+            'std': model.get_param_std(discard=discard).tolist(),
+            'acceptance': float(np.mean(model.sampler.acceptance_fraction)),
+            'seed': model.seed,
+            }
+
+
+class Worker(object):
+    """Claims and processes tasks from a Transport until none are left.
+
+    A background thread sends heartbeats while a task is being processed so
+    that the Coordinator can requeue the tasks of dead workers. The
+    heartbeats stop when a task exceeds its deadline, so that the tasks of
+    hung or slow workers are requeued as well. The result of a task that
+    was requeued in the meantime is discarded.
+
+    Args:
+        transport (:obj:`Transport`): The work queue.
+        task_fn (:obj:`callable`): A function of the spectrum ID and payload
+            returning a JSON-serializable result. Defaults to `fit_task`.
+        worker_id (:obj:`str`): A unique name for the worker. If None, one is
+            generated from the host name and process ID. Defaults to None.
+        heartbeat_interval (:obj:`float`): Seconds between two heartbeats.
+            Defaults to 10.
+        task_timeout (:obj:`float`): The deadline of a task, in seconds,
+            after which no more heartbeats are sent for it. If None, tasks
+            have no deadline. Defaults to None.
+
+    """
+
+    def __init__(self, transport, task_fn=fit_task, worker_id=None,
+                 heartbeat_interval=10, task_timeout=None):
+        self.transport = transport
+        self.task_fn = task_fn
+        self.worker_id = worker_id or (f'{socket.gethostname()}-{os.getpid()}'
+                                       f'-{uuid.uuid4().hex[:8]}')
+        self.heartbeat_interval = heartbeat_interval
+        self.task_timeout = task_timeout
+
+    def _beat(self, task_id, stop):
+        deadline = None
+        if self.task_timeout is not None:
+            deadline = time.time() + self.task_timeout
+        while not stop.wait(self.heartbeat_interval):
+            if deadline is not None and time.time() > deadline:
+                break
+            self.transport.heartbeat(task_id, self.worker_id)
+
+    def run(self, max_tasks=None, wait=0):
+        """Processes tasks.
+
+        Args:
+            max_tasks (:obj:`int`): The maximum number of tasks to process.
+                If None, runs until the queue is empty. Defaults to None.
+            wait (:obj:`float`): Seconds to wait for new tasks when the queue
+                is empty before returning. Defaults to 0.
+
+        Returns:
+            :obj:`int`: The number of processed tasks.
+
+        """
+        n = 0
+        idle_since = time.time()
+        while max_tasks is None or n < max_tasks:
+            task = self.transport.claim(self.worker_id)
+            if task is None:
+                if time.time() - idle_since >= wait:
+                    break
+                time.sleep(min(1, wait))
+                continue
+            task_id, payload = task
+            stop = threading.Event()
+            beat = threading.Thread(target=self._beat, args=(task_id, stop),
+                                    daemon=True)
+            beat.start()
+            try:
+                result = self.task_fn(task_id, payload)
+            except Exception as e:
+                self.transport.fail(task_id, self.worker_id, repr(e))
+            else:
+                self.transport.complete(task_id, self.worker_id, result)
+            finally:
+                stop.set()
+                beat.join()
+            n += 1
+            idle_since = time.time()
+        return n
+
+
+class Coordinator(object):
+    """Hands out spectra to Workers and collects their results.
+
+    Args:
+        transport (:obj:`Transport`): The work queue.
+        heartbeat_timeout (:obj:`float`): Seconds without a heartbeat after
+            which a running task is considered lost and requeued. Defaults to
+            60.
+        max_attempts (:obj:`int`): The number of times a task is attempted
+            before it is left failed. Defaults to 3.
+        seed: The random seed of the batch (see `utils.seed_sequence`). The
+            seed of every spectrum is derived from it and from the spectrum
+            ID, and stored in the task payload, so that requeued tasks are
+            rerun with the same seed. Defaults to None.
+
+    """
+
+    def __init__(self, transport, heartbeat_timeout=60, max_attempts=3,
+                 seed=None):
+        self.transport = transport
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_attempts = max_attempts
+        self.seed_sequence = seed_sequence(seed)
+
+    def submit(self, tasks):
+        """Queues tasks.
+
+        Args:
+            tasks (:obj:`dict`): Task payloads (see `fit_task`) keyed by
+                spectrum ID. Payloads without a `seed` are given the seed
+                of their spectrum.
+
+        """
+        seeded = {}
+        for k, payload in tasks.items():
+            if 'seed' not in payload:
+                ss = spectrum_seed(self.seed_sequence, k)
+                payload = dict(payload, seed={'entropy': ss.entropy,
+                                              'spawn_key': list(ss.spawn_key)})
+            seeded[k] = payload
+        self.transport.put(seeded)
+
+    def monitor(self, poll=5, timeout=None):
+        """Requeues lost and failed tasks until all tasks are finished.
+
+        Args:
+            poll (:obj:`float`): Seconds between two checks. Defaults to 5.
+            timeout (:obj:`float`): Maximum number of seconds to wait. If
+                None, waits until all tasks are finished. Defaults to None.
+
+        Returns:
+            :obj:`dict`: The number of tasks in each status.
+
+        """
+        start = time.time()
+        while True:
+            self.transport.requeue(self.heartbeat_timeout, self.max_attempts)
+            counts = self.transport.counts()
+            if not counts.get('pending') and not counts.get('running'):
+                return counts
+            if timeout is not None and time.time() - start > timeout:
+                return counts
+            time.sleep(poll)
+
+    def results(self):
+        """Returns the results of the completed tasks, keyed by ID. """
+        return self.transport.results()
@@ -7,16 +7,20 @@
 # @Last modified time: 2020-03-19T11:47:29-04:00
 
 
+import time
+
 import emcee
 import numpy as np
 
-from .cython_funcs import Decomp_cyth
 from .cython_funcs import ColeCole_cyth
 from .cython_funcs import Dias2000_cyth
 from .cython_funcs import Shin2015_cyth
 
 from . import utils
 from . import plotlib
+from .moves import LinearGibbsMove
+from .moves import SnookerMove
+from .cache import debye_kernel, decomposition_grid
 
 
 class Inversion(plotlib.plotlib, utils.utils):
@@ -26,7 +30,9 @@ class Inversion(plotlib.plotlib, utils.utils):
     ColeCole classes.
 
     Args:
-        filepath (:obj:`str`): The path to the file to perform inversion on.
+        filepath (:obj:`str` or :obj:`ndarray`): The path to the file to
+            perform inversion on, or an array with the same columns as the
+            data files (freq, amp, pha, amp_err, pha_err) for in-memory data.
         nwalkers (:obj:`int`): Number of walkers to use to explore the
             parameter space. Defaults to 32.
         nsteps (:obj:`int`): Number of steps to perform in the MCMC
@@ -35,11 +41,32 @@ class Inversion(plotlib.plotlib, utils.utils):
             Defaults to 1.
         ph_units (:obj:`str`): The units of the phase shift measurements.
             Choices: 'mrad', 'rad', 'deg'. Defaults to 'mrad'.
+        transform (:obj:`bool`): Whether to sample the logit-transformed
+            parameters, which are unbounded, instead of rejecting the
+            proposals that fall outside of the parameter bounds. Chains
+            obtained with `get_chain` are mapped back to the original
+            parameters, while the `sampler` holds the transformed ones.
+            Defaults to False.
+        seed: The random seed of the starting values and of the sampler: an
+            int, a `numpy.random.SeedSequence` or the value of the `seed`
+            property of a previous model. Every fit with the same seed
+            gives the same chain. If None, fresh entropy is drawn and
+            recorded in the `seed` property. Defaults to None.
+        likelihood (:obj:`str`): The noise model of the measurements.
+            Choices: 'gaussian', or 'student' for a Student-t noise model,
+            whose heavy tails make the fit robust to a few outliers.
+            Defaults to 'gaussian'.
+        nu (:obj:`float`): The degrees of freedom of the Student-t noise
+            model. Smaller values give heavier tails. Defaults to 4.
 
     """
 
+    # Attributes passed back as keyword arguments to rebuild the model
+    _config_attrs = ('nwalkers', 'nsteps', 'ph_units', 'likelihood', 'nu')
+
     def __init__(self, filepath, nwalkers=32, nsteps=5000, headers=1,
-                 ph_units='mrad'):
+                 ph_units='mrad', transform=False, seed=None,
+                 likelihood='gaussian', nu=4.0):
 
         # Get arguments
         self.filepath = filepath
@@ -47,19 +74,52 @@ class Inversion(plotlib.plotlib, utils.utils):
         self.nsteps = nsteps
         self.headers = headers
         self.ph_units = ph_units
+        self.transform = transform
+        self.seed_sequence = utils.seed_sequence(seed)
+        if likelihood not in ('gaussian', 'student'):
+            raise ValueError('Invalid likelihood. Choices: gaussian, '
+                             'student.')
+        self.likelihood = likelihood
+        self.nu = nu
+        self.moves = None
+        self.chunk_size = 10000
+        self.tuning = None
 
         # Set default attributes
         self._p0 = None
         self._params = {}
         self.__fitted = False
+        self._n_evals = 0
+        self._n_rejected = 0
+        self._percentile_cache = {}
+        self._noise = None
 
         # Load data
         self._data = self.load_data(self.filepath, self.headers, self.ph_units)
 
+    def _noise_terms(self, yerr):
+        """Returns the inverse variances and the normalization constant.
+
+        They do not depend on the parameters, so they are computed once for
+        a given error array instead of at every likelihood evaluation.
+        """
+        if self._noise is None or self._noise[0] is not yerr:
+            sigma2 = yerr**2
+            self._noise = (yerr, 1/sigma2, np.sum(2*np.log(sigma2)))
+        return self._noise[1:]
+
+    def _misfit(self, chi2, axis=None):
+        """Returns minus twice the log-likelihood, up to a constant, of the
+        squared normalized residuals. """
+        if self.likelihood == 'student':
+            return (self.nu + 1)*np.sum(np.log1p(chi2/self.nu), axis=axis)
+        return np.sum(chi2, axis=axis)
+
     def _log_likelihood(self, theta, f, x, y, yerr):
         """Returns the conditional log-likelihood of the observations. """
-        sigma2 = yerr**2
-        return -0.5*np.sum((y - f(theta, x))**2 / sigma2 + 2*np.log(sigma2))
+        inv_sigma2, log_norm = self._noise_terms(yerr)
+        return -0.5*(self._misfit((y - f(theta, x))**2 * inv_sigma2)
+                     + log_norm)
 
     def _log_prior(self, theta, bounds):
         """Returns the prior log-probability of the model parameters. """
@@ -70,18 +130,110 @@ class Inversion(plotlib.plotlib, utils.utils):
 
     def _log_probability(self, theta, model, bounds, x, y, yerr):
         """Returns the Bayes numerator log-probability. """
+        self._n_evals += 1
         lp = self._log_prior(theta, bounds)
         if not np.isfinite(lp):
+            self._n_rejected += 1
             return -np.inf
         return lp + self._log_likelihood(theta, model, x, y, yerr)
 
+    def _log_probability_unbounded(self, u, model, bounds, x, y, yerr):
+        """Returns the log-probability of the logit-transformed parameters.
+        """
+        theta = self._from_unbounded(u, bounds)
+        log_jac = np.sum(np.log(bounds[1] - bounds[0])
+                         - np.logaddexp(0, u) - np.logaddexp(0, -u))
+        lp = self._log_probability(theta, model, bounds, x, y, yerr)
+        if not np.isfinite(lp):
+            return -np.inf
+        return lp + log_jac
+
+    def _log_probability_batch(self, coords, model, bounds, x, y, yerr):
+        """Returns the log-probabilities of all walkers at once. """
+        theta = coords
+        log_jac = 0
+        if self.transform:
+            theta = self._from_unbounded(coords, bounds)
+            log_jac = np.sum(np.log(bounds[1] - bounds[0])
+                             - np.logaddexp(0, coords)
+                             - np.logaddexp(0, -coords), axis=1)
+        inside = ((bounds[0] < theta) & (theta < bounds[1])).all(axis=1)
+        self._n_evals += theta.shape[0]
+        self._n_rejected += np.sum(~inside)
+        lp = np.full(theta.shape[0], -np.inf)
+        if inside.any():
+            inv_sigma2, log_norm = self._noise_terms(yerr)
+            Z = model(theta[inside], x)
+            lp[inside] = -0.5*(self._misfit((y - Z)**2 * inv_sigma2,
+                                            axis=(1, 2)) + log_norm)
+        lp = lp + log_jac
+        lp[~np.isfinite(lp)] = -np.inf
+        return lp
+
+    def _random_streams(self):
+        """Returns the random generators of the starting values and MCMC.
+
+        They are derived from a fresh copy of the seed sequence, so every
+        call returns the same streams.
+        """
+        ss = utils.seed_sequence(self.seed)
+        p0_seq, mcmc_seq = ss.spawn(2)
+        return (np.random.default_rng(p0_seq),
+                np.random.RandomState(np.random.MT19937(mcmc_seq)))
+
+    def _to_unbounded(self, theta, bounds):
+        """Maps parameters from their bounds to the real line. """
+        return np.log((theta - bounds[0]) / (bounds[1] - theta))
+
+    def _from_unbounded(self, u, bounds):
+        """Maps unbounded parameters back to their bounds. """
+        return bounds[0] + (bounds[1] - bounds[0]) / (1 + np.exp(-u))
+
+    def _set_chain(self, sampler):
+        """Attaches the results of an earlier fit, e.g. a stored chain. """
+        self._sampler = sampler
+        self.ndim = self.param_bounds.shape[1]
+        self.__fitted = True
+
+    def get_config(self):
+        """Gets the settings needed to rebuild the model.
+
+        Returns:
+            :obj:`dict`: The name of the model class (`model`), its keyword
+            arguments (`model_kwargs`), the parameter bounds (`params`) and
+            the random seed (`seed`).
+
+        """
+        return {'model': type(self).__name__,
+                'model_kwargs': {k: getattr(self, k)
+                                 for k in self._config_attrs},
+                'params': {k: list(v) for k, v in self.params.items()},
+                'seed': self.seed,
+                }
+
     def _check_if_fitted(self):
         """Checks if the model has been fitted. """
         if not self.fitted:
             raise AssertionError('Model is not fitted! Fit the model to a '
                                  'dataset before attempting to plot results.')
 
-    def fit(self, p0=None, pool=None, moves=None):
+    def default_moves(self):
+        """Returns a sensible emcee move mixture for this model.
+
+        Differential evolution moves mixed with snooker updates (see
+        `moves.SnookerMove`) are used by default since the SIP models often
+        have strongly correlated or multimodal posteriors (e.g. ColeCole modes
+        exchanging their relaxation times).
+
+        Returns:
+            :obj:`list`: A list of (move, weight) tuples to pass to `fit`.
+
+        """
+        return [(emcee.moves.DEMove(), 0.8),
+                (SnookerMove(), 0.2)]
+
+    def fit(self, p0=None, pool=None, moves=None, progress=True,
+            callback=None, vectorize=False):
         """Samples the posterior distribution to fit the model to the data.
 
         Args:
@@ -94,30 +246,187 @@ class Inversion(plotlib.plotlib, utils.utils):
                 Defaults to None.
             moves (:obj:`moves`, optional): A `emcee` Moves class (see
                 https://emcee.readthedocs.io/en/stable/user/moves/). If None,
-                the emcee algorithm `StretchMove` is used. Defaults to None.
+                the `moves` attribute is used, which is None (the emcee
+                algorithm `StretchMove`) unless set by the tune method. If
+                'default', the move mixture returned by `default_moves` is
+                used. Defaults to None.
+            progress (:obj:`bool`): Whether or not to show a progress bar.
+                Defaults to True.
+            callback (:obj:`callable`, optional): A function called with the
+                number of completed steps after every MCMC step. Raise an
+                exception from it to abort the simulation. Defaults to None.
+            vectorize (:obj:`bool`): Whether to evaluate the log-probability
+                of all walkers at once with the forward_batch method. This is
+                much faster for models with a vectorized forward_batch, but
+                the `pool` is then ignored. Defaults to False.
 
         """
         self._p0 = p0
         # self._bounds = self.param_bounds
         self.ndim = self.param_bounds.shape[1]
 
+        rng, random_state = self._random_streams()
         if self._p0 is None:
-            self._p0 = np.random.uniform(*self.param_bounds,
-                                         (self.nwalkers, self.ndim))
+            self._p0 = rng.uniform(*self.param_bounds,
+                                   (self.nwalkers, self.ndim))
+
+        if moves is None:
+            moves = self.moves
+        if isinstance(moves, str) and moves == 'default':
+            moves = self.default_moves()
 
         model_args = (self.forward, self.param_bounds, self._data['w'],
                       self._data['zn'], self._data['zn_err'])
 
+        if self.transform:
+            log_prob_fn = self._log_probability_unbounded
+            start = self._to_unbounded(self._p0, self.param_bounds)
+        else:
+            log_prob_fn = self._log_probability
+            start = self._p0
+        if vectorize:
+            log_prob_fn = self._log_probability_batch
+            model_args = (self.forward_batch,) + model_args[1:]
+
+        self._n_evals = 0
+        self._n_rejected = 0
+        self._percentile_cache = {}
         self._sampler = emcee.EnsembleSampler(self.nwalkers,
                                               self.ndim,
-                                              self._log_probability,
+                                              log_prob_fn,
                                               args=model_args,
                                               pool=pool,
                                               moves=moves,
+                                              vectorize=vectorize,
                                               )
-        self._sampler.run_mcmc(self._p0, self.nsteps, progress=True)
+        self._sampler.random_state = random_state.get_state()
+        t0 = time.perf_counter()
+        for _ in self._sampler.sample(start, iterations=self.nsteps,
+                                      progress=progress):
+            if callback is not None:
+                callback(self._sampler.iteration)
+        self._fit_time = time.perf_counter() - t0
         self.__fitted = True
 
+    def get_diagnostics(self, discard=None):
+        """Gets the sampling efficiency of the last fit.
+
+        Args:
+            discard (:obj:`int`): Number of steps to discard before computing
+                the autocorrelation time. If None, half of the chain is
+                discarded. Defaults to None.
+
+        Returns:
+            :obj:`dict`: A dict holding the wall time of the fit (`time`), the
+            mean acceptance fraction (`acceptance`), the integrated
+            autocorrelation time of every parameter (`autocorr_time`), the
+            effective sample size computed from the largest autocorrelation
+            time (`ess`), the effective samples per second (`ess_per_sec`) and
+            the prior rejection rate (`prior_rejection_rate`).
+
+        """
+        self._check_if_fitted()
+        if discard is None:
+            discard = self._sampler.iteration // 2
+        tau = self._sampler.get_autocorr_time(discard=discard, quiet=True)
+        n_samples = np.prod(self._sampler.get_chain(discard=discard).shape[:2])
+        ess = n_samples / np.nanmax(tau)
+        return {'time': self._fit_time,
+                'acceptance': np.mean(self._sampler.acceptance_fraction),
+                'autocorr_time': tau,
+                'ess': ess,
+                'ess_per_sec': ess / self._fit_time,
+                'prior_rejection_rate': self.prior_rejection_rate,
+                }
+
+    def tune(self, pilot_steps=500, nwalkers=None, moves=None,
+             chunk_sizes=[100, 1000, 10000]):
+        """Picks the sampler settings giving the most effective samples/s.
+
+        Short pilot fits are run for every combination of candidate number of
+        walkers and move mixture, and the chunk size of the batched forward
+        evaluations is timed on the pilot samples. The best settings are
+        stored in the `nwalkers`, `moves` and `chunk_size` attributes, which
+        are used by subsequent fits, and all measurements are recorded in the
+        `tuning` attribute. The pilot fits are then discarded, so the model is
+        left unfitted, or with the results of its earlier fit. Call `fit`
+        afterwards to sample with the chosen settings.
+
+        Args:
+            pilot_steps (:obj:`int`): The number of steps of the pilot fits.
+                Defaults to 500.
+            nwalkers (:obj:`list` of :obj:`int`): Candidate numbers of walkers.
+                If None, 2, 4 and 8 times the number of parameters are tried
+                (rounded up to an even number of at least 16). Defaults to
+                None.
+            moves (:obj:`dict`): Candidate move mixtures, keyed by name. If
+                None, the emcee `StretchMove` is compared to the model's
+                `default_moves`. A None candidate uses the `moves` attribute,
+                like the fit method. Defaults to None.
+            chunk_sizes (:obj:`list` of :obj:`int`): Candidate numbers of
+                samples per batched forward evaluation. Defaults to [100, 1000,
+                10000].
+
+        Returns:
+            :obj:`dict`: The chosen settings and the pilot measurements.
+
+        """
+        ndim = self.param_bounds.shape[1]
+        if nwalkers is None:
+            nwalkers = sorted({max(16, 2*((k*ndim + 1)//2)) for k in (2, 4, 8)})
+        if moves is None:
+            moves = {'stretch': emcee.moves.StretchMove(),
+                     'default': 'default'}
+
+        # The results of an earlier fit, restored after the pilot fits
+        state = {k: getattr(self, k) for k in
+                 ('_p0', '_n_evals', '_n_rejected', '_percentile_cache',
+                  '_Inversion__fitted', '_sampler', '_fit_time')
+                 if hasattr(self, k)}
+        nsteps = self.nsteps
+        self.nsteps = pilot_steps
+        pilots = []
+        samples = {}
+        try:
+            for n in nwalkers:
+                for name, m in moves.items():
+                    self.nwalkers = n
+                    self.fit(moves=m, progress=False)
+                    d = self.get_diagnostics()
+                    pilots.append({'nwalkers': n, 'moves': name,
+                                   'ess_per_sec': d['ess_per_sec'],
+                                   'acceptance': d['acceptance']})
+                    samples[n, name] = self.get_chain(
+                        discard=pilot_steps//2, flat=True)
+        finally:
+            self.nsteps = nsteps
+            for k in ('_sampler', '_fit_time'):
+                if k not in state and hasattr(self, k):
+                    delattr(self, k)
+            self.__dict__.update(state)
+        best = max(pilots, key=lambda x: np.nan_to_num(x['ess_per_sec'],
+                                                       nan=-np.inf))
+        self.nwalkers = best['nwalkers']
+        self.moves = moves[best['moves']]
+
+        # Time the batched forward evaluations on the pilot samples
+        samples = samples[best['nwalkers'], best['moves']]
+        timings = {}
+        for c in chunk_sizes:
+            thetas = np.resize(samples, (c, ndim))
+            t0 = time.perf_counter()
+            self.forward_batch(thetas, self._data['w'])
+            timings[c] = (time.perf_counter() - t0) / c
+        self.chunk_size = min(timings, key=timings.get)
+
+        self.tuning = {'nwalkers': self.nwalkers,
+                       'moves': best['moves'],
+                       'chunk_size': self.chunk_size,
+                       'pilots': pilots,
+                       'chunk_timings': timings,
+                       }
+        return self.tuning
+
     def get_chain(self, **kwargs):
         """Gets the MCMC chains from a fitted model.
 
@@ -134,7 +443,56 @@ class Inversion(plotlib.plotlib, utils.utils):
 
         """
         self._check_if_fitted()
-        return self._sampler.get_chain(**kwargs)
+        chain = self._sampler.get_chain(**kwargs)
+        if self.transform:
+            chain = self._from_unbounded(chain, self.param_bounds)
+        return chain
+
+    def iter_chain(self, chunk_size=1000, discard=0, thin=1):
+        """Iterates over the MCMC chain in chunks of flattened samples.
+
+        The chunks are taken from the stored chain without copying it as a
+        whole, which keeps the memory usage low for long chains.
+
+        Args:
+            chunk_size (:obj:`int`): The number of steps per chunk. Each chunk
+                holds chunk_size*nwalkers samples. Defaults to 1000.
+            discard (:obj:`int`): Number of steps to discard (burn-in period).
+                Defaults to 0.
+            thin (:obj:`int`): Thinning factor. Defaults to 1.
+
+        Yields:
+            :obj:`ndarray`: Chunks of samples with shape (n, ndim).
+
+        """
+        self._check_if_fitted()
+        chain = self._sampler.get_chain(discard=discard, thin=thin)
+        for i in range(0, chain.shape[0], chunk_size):
+            chunk = chain[i:i+chunk_size].reshape(-1, chain.shape[-1])
+            if self.transform:
+                chunk = self._from_unbounded(chunk, self.param_bounds)
+            yield chunk
+
+    def forward_batch(self, thetas, w):
+        """Returns the model impedance for many parameter vectors at once.
+
+        Models with a vectorized implementation override this method. By
+        default, the forward method is called for every parameter vector.
+
+        Args:
+            thetas (:obj:`ndarray`): A 2D array of parameter values with shape
+                (n, ndim), e.g. a flattened MCMC chain.
+            w (:obj:`ndarray`): Array of angular frequencies to compute the
+                impedance for (w = 2*pi*f).
+
+        Returns:
+            :obj:`ndarray`: The impedances, with shape (n, 2, N).
+
+        """
+        results = np.empty((thetas.shape[0], 2, w.shape[0]))
+        for i in range(thetas.shape[0]):
+            results[i] = self.forward(thetas[i], w)
+        return results
 
     @property
     def p0(self):
@@ -151,6 +509,13 @@ class Inversion(plotlib.plotlib, utils.utils):
     def params(self, var):
         self._params = var
 
+    @property
+    def seed(self):
+        """:obj:`dict`: The entropy and spawn key of the random seed, to
+        record with the results and pass back as `seed` to reproduce them."""
+        return {'entropy': self.seed_sequence.entropy,
+                'spawn_key': list(self.seed_sequence.spawn_key)}
+
     @property
     def sampler(self):
         """:obj:`EnsembleSampler`: A `emcee` sampler object (see
@@ -158,6 +523,17 @@ class Inversion(plotlib.plotlib, utils.utils):
         self._check_if_fitted()
         return self._sampler
 
+    @property
+    def prior_rejection_rate(self):
+        """:obj:`float`: Fraction of the log-probability evaluations that
+            were rejected by the prior for falling outside of the parameter
+            bounds. Only evaluations done in the current process are counted
+            (i.e. not those dispatched to a `pool`)."""
+        self._check_if_fitted()
+        if self._n_evals == 0:
+            return np.nan
+        return self._n_rejected / self._n_evals
+
     @property
     def data(self):
         """:obj:`dict`: The input data dictionary."""
@@ -188,25 +564,33 @@ class PolynomialDecomposition(Inversion):
             decomposition. Defaults to 5.
         c_exp (:obj:`float`): The c-exponent to use for the decomposition
             scheme. 0.5 -> Warburg, 1.0 -> Debye. Defaults to 1.0.
+        n_tau (:obj:`int`): The number of relaxation times in the RTD. If
+            None, twice the number of frequencies is used. Set it to a few
+            hundred for dense spectra with thousands of frequencies.
+            Defaults to None.
         **kwargs: Additional keyword arguments passed to the Inversion class.
 
     """
 
-    def __init__(self, *args, poly_deg=5, c_exp=1.0, **kwargs):
+    _config_attrs = Inversion._config_attrs + ('poly_deg', 'c_exp', 'n_tau')
+
+    def __init__(self, *args, poly_deg=5, c_exp=1.0, n_tau=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.c_exp = c_exp
         self.poly_deg = poly_deg
 
-        # Define a range of relaxation time values for the RTD
-        min_tau = np.floor(min(np.log10(1./self._data['w'])) - 1)
-        max_tau = np.floor(max(np.log10(1./self._data['w'])) + 1)
-        n_tau = 2*self._data['N']
-        self.log_tau = np.linspace(min_tau, max_tau, n_tau)
-
-        # Precompute the log_tau_i**i values for the polynomial approximation
+        # Get the relaxation times and projected kernel shared by all models
+        # using the same frequencies (see cache.decomposition_grid)
+        grid = decomposition_grid(self._data['w'], self.poly_deg, self.c_exp,
+                                  n_tau)
+        self.log_tau = grid['log_tau']
+        self.log_taus = grid['log_taus']
+        self.taus = grid['taus']  # Accelerates sampling
+        self.basis = grid['basis']
+        self.n_tau = self.taus.shape[0]
+        self._e = np.concatenate([np.ones(self._data['N']),
+                                  np.zeros(self._data['N'])])
         deg_range = list(range(self.poly_deg+1))
-        self.log_taus = np.array([self.log_tau**i for i in deg_range])
-        self.taus = 10**self.log_tau  # Accelerates sampling
 
         # Add polynomial decomposition parameters to dict
         self.params.update({'r0': [0.9, 1.1]})
@@ -214,6 +598,23 @@ class PolynomialDecomposition(Inversion):
 
         # self._bounds = np.array(self.param_bounds).T
 
+    def default_moves(self):
+        """Returns a sensible emcee move mixture for this model.
+
+        Stretch moves are alternated with Gibbs-like updates of R0 and of the
+        polynomial coefficients, in which the impedance is linear. The
+        Gibbs-like updates are done in the original parameter space and are
+        not used when `transform` is True.
+
+        Returns:
+            :obj:`list`: A list of (move, weight) tuples to pass to `fit`.
+
+        """
+        if self.transform:
+            return super().default_moves()
+        return [(emcee.moves.StretchMove(), 0.5),
+                (LinearGibbsMove(self), 0.5)]
+
     def forward(self, theta, w):
         """Returns a Polynomial Decomposition impedance.
 
@@ -225,8 +626,228 @@ class PolynomialDecomposition(Inversion):
                 impedance for (w = 2*pi*f).
 
         """
-        return Decomp_cyth(w, self.taus, self.log_taus, self.c_exp,
-                           R0=theta[0], a=theta[1:])
+        if w is self._data['w'] or np.array_equal(w, self._data['w']):
+            z = theta[0]*(self._e - self.basis @ theta[1:])
+            return z.reshape(2, -1)
+        z = theta[0]*(1 - self._get_kernel(w) @ (theta[1:] @ self.log_taus))
+        return np.array([z.real, z.imag])
+
+    @property
+    def kernel(self):
+        """:obj:`ndarray`: The complex Debye kernel with shape (N, n_tau)."""
+        return debye_kernel(self._data['w'], self.taus, self.c_exp)
+
+    def _get_kernel(self, w):
+        """Returns the complex Debye kernel at other frequencies. """
+        return debye_kernel(w, self.taus, self.c_exp)
+
+    def forward_batch(self, thetas, w):
+        """Returns Polynomial Decomposition impedances for many parameters.
+
+        The impedance is linear in the RTD weights, which are themselves
+        linear in the polynomial coefficients, so all parameter vectors are
+        evaluated with a single product with the precomputed basis.
+
+        Args:
+            thetas (:obj:`ndarray`): A 2D array of parameter values with shape
+                (n, ndim), e.g. a flattened MCMC chain.
+            w (:obj:`ndarray`): Array of angular frequencies to compute the
+                impedance for (w = 2*pi*f).
+
+        Returns:
+            :obj:`ndarray`: The impedances, with shape (n, 2, N).
+
+        """
+        if w is self._data['w'] or np.array_equal(w, self._data['w']):
+            z = thetas[:, :1]*(self._e - thetas[:, 1:] @ self.basis.T)
+            return z.reshape(thetas.shape[0], 2, -1)
+        M = thetas[:, 1:] @ self.log_taus
+        z = thetas[:, :1]*(1 - M @ self._get_kernel(w).T)
+        return np.stack([z.real, z.imag], axis=1)
+
+    def solve(self, alpha=0.0, nonneg=False):
+        """Solves the decomposition deterministically by linear least squares.
+
+        The impedance is linear in R0 and in the RTD weights scaled by R0, so
+        the maximum a posteriori solution is obtained directly, without MCMC.
+        The uncertainties are computed from the linearised posterior
+        covariance. This is useful to screen large numbers of spectra or to
+        get starting values for the fit method.
+
+        Args:
+            alpha (:obj:`float`): The Tikhonov regularisation weight, which
+                acts as a zero-mean Gaussian prior with precision alpha on
+                the scaled polynomial coefficients (or on the scaled RTD
+                weights if `nonneg` is True). Defaults to 0.0.
+            nonneg (:obj:`bool`): Whether to constrain the RTD to be
+                non-negative. The RTD weights are then solved for directly
+                with non-negative least squares (requires scipy), and the
+                polynomial coefficients are fitted to them by least squares.
+                Defaults to False.
+
+        Returns:
+            :obj:`dict`: A dict holding the parameter values (`params`,
+            ordered as `param_names`), their covariance (`cov`) and standard
+            deviations (`std`), the RTD (`rtd`) and its standard deviation
+            (`rtd_std`), the total chargeability (`total_m`) and the weighted
+            sum of squared residuals (`chi2`).
+
+        """
+        e = self._e
+        sqrt_w = 1/np.concatenate(self._data['zn_err'])
+        y = np.concatenate(self._data['zn'])*sqrt_w
+
+        if nonneg:
+            try:
+                from scipy.optimize import nnls
+            except ImportError:
+                raise ImportError('The scipy package is required to solve '
+                                  'with nonneg=True. Install it with '
+                                  '`conda install scipy`')
+            K = self.kernel
+            B = np.vstack([K.real, K.imag])
+        else:
+            B = self.basis
+        A = np.column_stack([e, -B])*sqrt_w[:, None]
+        n = A.shape[1]
+        reg = np.sqrt(alpha)*np.eye(n)[1:]
+
+        if nonneg:
+            x = nnls(np.vstack([A, reg]), np.concatenate([y, np.zeros(n-1)]),
+                     maxiter=50*n)[0]
+            free = x > 0
+            free[0] = True
+        else:
+            x = np.linalg.lstsq(np.vstack([A, reg]),
+                                np.concatenate([y, np.zeros(n-1)]),
+                                rcond=None)[0]
+            free = np.ones(n, dtype=bool)
+
+        # Linearised posterior covariance of the free unknowns
+        P = A.T @ A + alpha*np.diag(np.r_[0, np.ones(n-1)])
+        cov_x = np.zeros((n, n))
+        cov_x[np.ix_(free, free)] = np.linalg.pinv(P[np.ix_(free, free)])
+
+        # Jacobian from (R0, R0*v) to (R0, v)
+        r0 = x[0]
+        J = np.zeros((n, n))
+        J[0, 0] = 1
+        J[1:, 0] = -x[1:] / r0**2
+        J[1:, 1:] = np.eye(n-1) / r0
+        v = x[1:] / r0
+        cov_v = J @ cov_x @ J.T
+
+        if nonneg:
+            # Project the RTD on the polynomial basis
+            T = np.linalg.pinv(self.log_taus.T)
+            Jt = np.zeros((self.poly_deg+2, n))
+            Jt[0, 0] = 1
+            Jt[1:, 1:] = T
+            cov = Jt @ cov_v @ Jt.T
+            params = np.r_[r0, T @ v]
+            rtd, cov_rtd = v, cov_v[1:, 1:]
+        else:
+            cov = cov_v
+            params = np.r_[r0, v]
+            rtd = v @ self.log_taus
+            cov_rtd = self.log_taus.T @ cov_v[1:, 1:] @ self.log_taus
+
+        return {'params': params,
+                'cov': cov,
+                'std': np.sqrt(np.diag(cov)),
+                'rtd': rtd,
+                'rtd_std': np.sqrt(np.diag(cov_rtd)),
+                'total_m': np.sum(rtd),
+                'chi2': np.sum((A @ x - y)**2),
+                }
+
+    def get_derived(self, chain=None, chunk_size=None, rtd=False, **kwargs):
+        """Computes quantities derived from the RTD for every sample.
+
+        The RTD, the total chargeability and the first moment of the RTD are
+        linear maps of the polynomial coefficients. They are computed with
+        matrix products over chunks of the chain.
+
+        Args:
+            chain (:obj:`ndarray`): A numpy array containing the MCMC chain.
+                Should be a 2D array (nsteps, ndim). If None, the chain is
+                obtained with the get_chain method. Defaults to None.
+            chunk_size (:obj:`int`): The number of samples processed at once.
+                If None, the `chunk_size` attribute is used. Defaults to None.
+            rtd (:obj:`bool`): Whether to also return the RTD of every
+                sample, which holds n_tau values per sample. Use
+                `get_derived_percentile` to summarize the RTD of long chains
+                on dense grids instead. Defaults to False.
+
+        Keyword Args:
+            **kwargs: See kwargs of the get_chain method.
+
+        Returns:
+            :obj:`dict`: A dict holding the total chargeability (`total_m`),
+            the log10 of the mean relaxation time (`log_mean_tau`) and the
+            mean relaxation time (`mean_tau`) of every sample, and their RTD
+            (`rtd`, shape (n, n_tau)) if `rtd` is True.
+
+        """
+        chain = self.parse_chain(chain, **kwargs)
+        chunk_size = chunk_size or self.chunk_size
+        n = chain.shape[0]
+        derived = {'total_m': np.empty(n),
+                   'log_mean_tau': np.empty(n),
+                   }
+        if rtd:
+            derived['rtd'] = np.empty((n, self.log_tau.shape[0]))
+        m_weights = self.log_taus.sum(axis=1)
+        tau_weights = self.log_taus @ self.log_tau
+        for i in range(0, n, chunk_size):
+            a = chain[i:i+chunk_size, 1:]
+            total_m = a @ m_weights
+            derived['total_m'][i:i+chunk_size] = total_m
+            derived['log_mean_tau'][i:i+chunk_size] = (a @ tau_weights
+                                                       / total_m)
+            if rtd:
+                derived['rtd'][i:i+chunk_size] = a @ self.log_taus
+        derived['mean_tau'] = 10**derived['log_mean_tau']
+        return derived
+
+    def get_derived_percentile(self, p=[2.5, 50, 97.5], chain=None,
+                               chunk_size=None, **kwargs):
+        """Gets percentiles of the quantities derived from the RTD.
+
+        The RTD percentiles are computed over blocks of relaxation times, so
+        that at most `chunk_size` samples of the full RTD are held in memory
+        at once, whatever the length of the chain.
+
+        Args:
+            p (:obj:`float` or :obj:`list` of :obj:`float`): percentiles values
+                to compute. Defaults to [2.5, 50, 97.5].
+            chain (:obj:`ndarray`): A numpy array containing the MCMC chain.
+                Should be a 2D array (nsteps, ndim). If None, the chain is
+                obtained with the get_chain method. Defaults to None.
+            chunk_size (:obj:`int`): The number of samples processed at once.
+                If None, the `chunk_size` attribute is used. Defaults to None.
+
+        Keyword Args:
+            **kwargs: See kwargs of the get_chain method.
+
+        Returns:
+            :obj:`dict`: Percentiles of every quantity returned by
+            `get_derived`, including the RTD, keyed by name.
+
+        """
+        chain = self.parse_chain(chain, **kwargs)
+        chunk_size = chunk_size or self.chunk_size
+        derived = self.get_derived(chain, chunk_size)
+        percentiles = {k: np.percentile(v, p, axis=0)
+                       for k, v in derived.items()}
+
+        n, n_tau = chain.shape[0], self.log_tau.shape[0]
+        block = max(1, chunk_size*n_tau // max(n, 1))
+        a = chain[:, 1:]
+        percentiles['rtd'] = np.concatenate(
+            [np.percentile(a @ self.log_taus[:, j:j+block], p, axis=0)
+             for j in range(0, n_tau, block)], axis=-1)
+        return percentiles
 
 
 class PeltonColeCole(Inversion):
@@ -240,6 +861,8 @@ class PeltonColeCole(Inversion):
 
     """
 
+    _config_attrs = Inversion._config_attrs + ('n_modes',)
+
     def __init__(self, *args, n_modes=1, **kwargs):
         super().__init__(*args, **kwargs)
         self.n_modes = n_modes
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author: charles
+# @Date:   2026-10-19
+# @Email:  charles@goldspot.ca
+# @Last modified by:   charles
+# @Last modified time: 2026-10-19
+
+
+import emcee
+import numpy as np
+from emcee.moves.move import Move
+from emcee.state import State
+
+
+class LinearGibbsMove(Move):
+    """A Gibbs-like move for the linear parameters of a decomposition.
+
+    In the polynomial decomposition scheme the impedance is linear in R0 and
+    in the products R0*a of R0 with the polynomial coefficients. The Gaussian
+    likelihood of these products is computed exactly and used as an
+    independence proposal, which is corrected with a Metropolis-Hastings step
+    for the change of variables and for the parameter bounds. With the default
+    Gaussian likelihood nearly all proposals that fall within the bounds are
+    accepted, so the walkers decorrelate in a single step.
+
+    Args:
+        model (:obj:`PolynomialDecomposition`): The model being fitted.
+        jitter (:obj:`float`): Relative diagonal loading added to the
+            precision matrix for numerical stability. Defaults to 1e-10.
+
+    """
+
+    def __init__(self, model, jitter=1e-10):
+        self.inversion = model
+
+        # Sensitivity of the impedance to R0 and to R0*a
+        data = model.data
+        A = np.column_stack([model._e, -model.basis])  # (2N, D+1)
+        y = np.concatenate(data['zn'])
+        inv_var = 1/np.concatenate(data['zn_err'])**2
+
+        P = A.T @ (inv_var[:, None]*A)
+        P[np.diag_indices_from(P)] *= 1 + jitter
+        self._L = np.linalg.cholesky(P)
+        self._mu = np.linalg.solve(self._L.T, np.linalg.solve(
+            self._L, A.T @ (inv_var*y)))
+
+    def _log_q(self, x):
+        """Returns the unnormalized log-density of the proposal. """
+        r = (x - self._mu) @ self._L
+        return -0.5*np.sum(r**2, axis=1)
+
+    def propose(self, model, state):
+        """Proposes new parameters independently of the current ones.
+
+        Args:
+            model: The `emcee` model object passed by the sampler.
+            state (:obj:`State`): The current state of the ensemble.
+
+        """
+        nwalkers, ndim = state.coords.shape
+        bounds = self.inversion.param_bounds
+        z = model.random.randn(ndim, nwalkers)
+        x_new = self._mu + np.linalg.solve(self._L.T, z).T
+        q = np.array(x_new, copy=True)
+        q[:, 1:] /= q[:, :1]
+
+        x_old = np.array(state.coords, copy=True)
+        x_old[:, 1:] *= x_old[:, :1]
+
+        inside = ((bounds[0] < q) & (q < bounds[1])).all(axis=1)
+        inside &= q[:, 0] > 0
+        new_log_probs = np.full(nwalkers, -np.inf)
+        new_blobs = None
+        if inside.any():
+            lp, blobs = model.compute_log_prob_fn(q[inside])
+            new_log_probs[inside] = lp
+            if blobs is not None:
+                new_blobs = np.empty((nwalkers,) + blobs.shape[1:],
+                                     dtype=blobs.dtype)
+                new_blobs[inside] = blobs
+
+        # Metropolis-Hastings ratio in (R0, R0*a) space, where the Jacobian
+        # of the change of variables is R0**(ndim-1)
+        with np.errstate(invalid='ignore'):
+            lnpdiff = (new_log_probs - state.log_prob
+                       - (ndim - 1)*np.log(np.abs(q[:, 0]/state.coords[:, 0]))
+                       + self._log_q(x_old) - self._log_q(x_new))
+        accepted = inside & (lnpdiff > np.log(model.random.rand(nwalkers)))
+
+        new_state = State(q, log_prob=new_log_probs, blobs=new_blobs)
+        state = self.update(state, new_state, accepted)
+        return state, accepted
+
+
+class SnookerMove(emcee.moves.DESnookerMove):
+    """A differential evolution snooker update (ter Braak and Vrugt, 2008).
+
+    A walker s moves along the line joining it to another walker z, by the
+    difference of the projections of two other walkers z1 and z2 on the unit
+    vector u = (s-z)/|s-z|, and the proposal q is accepted with the
+    Metropolis-Hastings factor (ndim-1)*log(|q-z|/|s-z|) of the snooker
+    update. Both differ from `emcee.moves.DESnookerMove` (at least up to
+    version 3.1.6), which projects on (s-z)/sqrt(|s-z|), so that its steps
+    are scaled by |s-z|, and halves this factor. Its chains do not converge
+    to the posterior.
+
+    Args:
+        gammas (:obj:`float`): The mean stretch factor of the proposal
+            vector. Defaults to 1.7.
+
+    """
+
+    def get_proposal(self, s, c, random):
+        Ns = len(s)
+        Nc = list(map(len, c))
+        ndim = s.shape[1]
+        q = np.empty_like(s)
+        metropolis = np.empty(Ns, dtype=np.float64)
+        for i in range(Ns):
+            w = np.array([c[j][random.randint(Nc[j])] for j in range(3)])
+            random.shuffle(w)
+            z, z1, z2 = w
+            delta = s[i] - z
+            norm = np.linalg.norm(delta)
+            u = delta / norm
+            q[i] = s[i] + u * self.gammas * (np.dot(u, z1) - np.dot(u, z2))
+            metropolis[i] = np.log(np.linalg.norm(q[i] - z)) - np.log(norm)
+        return q, (ndim - 1.0) * metropolis
+
+
+class DelayedAcceptanceMove(emcee.moves.StretchMove):
+    """A stretch move with delayed acceptance based on a cheap surrogate.
+
+    Proposals are first screened with a surrogate log-probability (e.g. from
+    a ForwardSurrogate), and the exact log-probability is only computed for
+    the proposals passing this first stage. The second stage corrects for the
+    surrogate error, so the move samples the exact posterior.
+
+    Args:
+        surrogate_log_prob (:obj:`callable`): A vectorized function returning
+            the approximate log-probabilities of the walker coordinates with
+            shape (n, ndim). See ForwardSurrogate.log_probability.
+        **kwargs: Additional keyword arguments passed to `StretchMove`.
+
+    """
+
+    def __init__(self, surrogate_log_prob, **kwargs):
+        super().__init__(**kwargs)
+        self.surrogate_log_prob = surrogate_log_prob
+        self.n_exact = 0
+        self.n_proposed = 0
+
+    def propose(self, model, state):
+        """Proposes stretch moves and accepts them in two stages.
+
+        Args:
+            model: The `emcee` model object passed by the sampler.
+            state (:obj:`State`): The current state of the ensemble.
+
+        """
+        nwalkers, ndim = state.coords.shape
+        if nwalkers < 2 * ndim and not self.live_dangerously:
+            raise RuntimeError("It is unadvisable to use a red-blue move "
+                               "with fewer walkers than twice the number of "
+                               "dimensions.")
+
+        accepted = np.zeros(nwalkers, dtype=bool)
+        all_inds = np.arange(nwalkers)
+        inds = all_inds % self.nsplits
+        if self.randomize_split:
+            model.random.shuffle(inds)
+        for split in range(self.nsplits):
+            S1 = inds == split
+            sets = [state.coords[inds == j] for j in range(self.nsplits)]
+            s = sets[split]
+            c = sets[:split] + sets[split + 1:]
+            q, factors = self.get_proposal(s, c, model.random)
+
+            # First stage on the surrogate
+            ls_old = self.surrogate_log_prob(s)
+            ls_new = self.surrogate_log_prob(q)
+            with np.errstate(invalid='ignore'):
+                diff = factors + ls_new - ls_old
+            first = diff > np.log(model.random.rand(len(q)))
+
+            # Second stage on the exact log-probability
+            new_log_probs = np.full(len(q), -np.inf)
+            new_blobs = None
+            if first.any():
+                lp, blobs = model.compute_log_prob_fn(q[first])
+                new_log_probs[first] = lp
+                if blobs is not None:
+                    new_blobs = np.empty((len(q),) + blobs.shape[1:],
+                                         dtype=blobs.dtype)
+                    new_blobs[first] = blobs
+            with np.errstate(invalid='ignore'):
+                diff = (new_log_probs - state.log_prob[S1]
+                        - (ls_new - ls_old))
+            second = first & (diff > np.log(model.random.rand(len(q))))
+            accepted[S1] = second
+            self.n_exact += first.sum()
+            self.n_proposed += len(q)
+
+            new_state = State(q, log_prob=new_log_probs, blobs=new_blobs)
+            state = self.update(state, new_state, accepted, S1)
+
+        return state, accepted
+
+
+def benchmark_moves(model, moves=None, discard=None, **kwargs):
+    """Measures the effective samples per second of various move mixtures.
+
+    The model is fitted once per candidate and the effective sample size is
+    computed from the largest integrated autocorrelation time of the
+    parameters (after discarding the burn-in period).
+
+    Args:
+        model (:obj:`Inversion`): The model to benchmark. It is refitted for
+            every candidate and is left fitted with the last one.
+        moves (:obj:`dict`): Candidate move mixtures, keyed by name. If None,
+            compares the emcee default `StretchMove` to the model's
+            `default_moves`. Defaults to None.
+        discard (:obj:`int`): Number of steps to discard before computing the
+            autocorrelation time. If None, half of the chain is discarded.
+            Defaults to None.
+        **kwargs: Additional keyword arguments passed to the `fit` method.
+
+    Returns:
+        :obj:`dict`: For every candidate, the diagnostics returned by the
+        get_diagnostics method of the model.
+
+    """
+    if moves is None:
+        moves = {'stretch': emcee.moves.StretchMove(),
+                 'default': model.default_moves()}
+    kwargs.setdefault('progress', False)
+
+    results = {}
+    for name, m in moves.items():
+        model.fit(moves=m, **kwargs)
+        results[name] = model.get_diagnostics(discard)
+    return results
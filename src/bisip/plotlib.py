@@ -7,14 +7,76 @@
 # @Last modified time: 2020-03-23T15:49:25-04:00
 
 
+import os
+from multiprocessing import Pool
+
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.gridspec import GridSpec
 from corner import corner
 
 
+def _decimate(chain, max_points):
+    """Keeps at most max_points evenly spaced samples along the first axis.
+    """
+    if max_points is None or len(chain) <= max_points:
+        return chain, 1
+    stride = int(np.ceil(len(chain) / max_points))
+    return chain[::stride], stride
+
+
+def _save_report(args):
+    """Saves the report figure of a single model (used by save_reports). """
+    model, filepath, dpi, kwargs = args
+    # Render off-screen without touching the pyplot state of the caller
+    model._check_if_fitted()
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    model._draw_report(fig, **kwargs)
+    fig.savefig(filepath, dpi=dpi, bbox_inches='tight')
+    return filepath
+
+
+def save_reports(models, dirpath, names=None, processes=None, fmt='png',
+                 dpi=96, **kwargs):
+    """Renders and saves the report figures of many fitted models.
+
+    Figures are rendered off-screen with the Agg backend, in parallel if
+    `processes` is not 1.
+
+    Args:
+        models (:obj:`list` of :obj:`Inversion`): The fitted models.
+        dirpath (:obj:`str`): The directory in which to save the figures.
+        names (:obj:`list` of :obj:`str`): File names (without extension)
+            of the figures. If None, the models are numbered. Defaults to
+            None.
+        processes (:obj:`int`): The number of worker processes. If None, the
+            number of CPUs is used. Defaults to None.
+        fmt (:obj:`str`): The file format of the figures. Defaults to 'png'.
+        dpi (:obj:`int`): The resolution of the figures. Defaults to 96.
+        **kwargs: Additional keyword arguments passed to the plot_report
+            method (e.g. discard and thin).
+
+    Returns:
+        :obj:`list` of :obj:`str`: The paths to the saved figures.
+
+    """
+    if names is None:
+        names = [f'{i}' for i in range(len(models))]
+    os.makedirs(dirpath, exist_ok=True)
+    jobs = [(m, os.path.join(dirpath, f'{n}.{fmt}'), dpi, kwargs)
+            for m, n in zip(models, names)]
+    if processes == 1:
+        return [_save_report(j) for j in jobs]
+    with Pool(processes) as pool:
+        return pool.map(_save_report, jobs)
+
+
 class plotlib(object):
 
-    def plot_traces(self, chain=None, **kwargs):
+    def plot_traces(self, chain=None, max_points=None, **kwargs):
         """
         Plots the traces of the MCMC simulation.
 
@@ -23,6 +85,9 @@ class plotlib(object):
                 plot. Should have a shape (nsteps, nwalkers, ndim) or
                 (nsteps*nwalkers, ndim). If None, the full, unflattened chain
                 will be used and all walkers will be plotted. Defaults to None.
+            max_points (:obj:`int`): The maximum number of steps to draw for
+                each walker. Longer chains are decimated for display. If None,
+                all steps are drawn. Defaults to None.
             **kwargs: Additional keyword arguments for the get_chain function
                 (see below). Use these arguments only if not explicitly passing
                 the `chain` argument.
@@ -38,20 +103,27 @@ class plotlib(object):
 
         """
         self._check_if_fitted()
+        fig, axes = plt.subplots(self.ndim, figsize=(8, 6), sharex=True)
+        self._draw_traces(axes, chain, max_points, **kwargs)
+        fig.tight_layout()
+        return fig
+
+    def _draw_traces(self, axes, chain=None, max_points=None, **kwargs):
+        """Draws the (decimated) traces of every parameter on axes. """
         if chain is None:
             chain = self.get_chain(**kwargs)
+        n_steps = len(chain)
+        chain, stride = _decimate(chain, max_points)
+        steps = np.arange(n_steps)[::stride]
         labels = self.param_names
-        fig, axes = plt.subplots(self.ndim, figsize=(8, 6), sharex=True)
         for i in range(self.ndim):
             ax = axes[i]
-            ax.plot(chain[:, :, i], 'k', alpha=0.3)
-            ax.set_xlim(0, len(chain))
+            ax.plot(steps, chain[:, :, i], 'k', alpha=0.3)
+            ax.set_xlim(0, n_steps)
             ax.set_ylim(self.param_bounds[:, i])
             ax.set_ylabel(labels[i])
             ax.yaxis.set_label_coords(-0.1, 0.5)
         axes[-1].set_xlabel('Steps')
-        fig.tight_layout()
-        return fig
 
     def plot_histograms(self, chain=None, bins=25, **kwargs):
         """
@@ -118,9 +190,15 @@ class plotlib(object):
 
         """
         self._check_if_fitted()
+        fig, ax = plt.subplots(1, 2, figsize=(8, 3))
+        self._draw_fit(ax, chain, p, **kwargs)
+        fig.tight_layout()
+        return fig
+
+    def _draw_fit(self, ax, chain=None, p=[2.5, 50, 97.5], **kwargs):
+        """Draws the data and fitted real and imaginary parts on ax. """
         data = self.data
         lines = self.get_model_percentile(p, chain, **kwargs)
-        fig, ax = plt.subplots(1, 2, figsize=(8, 3))
         for i in range(2):
             ax[i].errorbar(data['freq'], data['zn'][i], yerr=data['zn_err'][i],
                            markersize=3, fmt=".k", capsize=0)
@@ -131,9 +209,51 @@ class plotlib(object):
             # ax[i].yaxis.set_label_coords(-0.2, 0.5)
             ax[i].set_xscale('log')
             ax[i].set_xlabel('$f$ (Hz)')
-        fig.tight_layout()
+
+    def plot_report(self, p=[2.5, 50, 97.5], max_points=500, **kwargs):
+        """
+        Plots a summary of an inversion for quality control.
+
+        Shows the fitted real and imaginary parts on top of the decimated
+        traces of every parameter. Meant to be used with the save_reports
+        function to render the reports of many inversions.
+
+        Args:
+            p (:obj:`list` of :obj:`int`): Percentile values for lower
+                confidence interval, best fit curve, and upper confidence
+                interval, **in that order**. Defaults to [2.5, 50, 97.5].
+            max_points (:obj:`int`): The maximum number of steps to draw for
+                each walker in the traces. Defaults to 500.
+            **kwargs: Additional keyword arguments for the get_chain function
+                (see below), used to compute the fit percentiles. The traces
+                always show the full chain.
+
+        Keyword Args:
+            discard (:obj:`int`): The number of steps to discard.
+            thin (:obj:`int`): The thinning factor (keep every `thin` step).
+
+        Returns:
+            :obj:`Figure`: A matplotlib figure.
+
+        """
+        self._check_if_fitted()
+        fig = plt.figure()
+        self._draw_report(fig, p, max_points, **kwargs)
         return fig
 
+    def _draw_report(self, fig, p=[2.5, 50, 97.5], max_points=500,
+                     **kwargs):
+        """Draws the fit and the decimated traces on an empty figure. """
+        fig.set_size_inches(8, 3 + 0.8*self.ndim)
+        gs = GridSpec(2 + self.ndim, 2, figure=fig)
+        ax_fit = [fig.add_subplot(gs[:2, i]) for i in range(2)]
+        ax_traces = [fig.add_subplot(gs[2+i, :]) for i in range(self.ndim)]
+        self._draw_fit(ax_fit, None, p, **kwargs)
+        self._draw_traces(ax_traces, None, max_points)
+        for ax in ax_traces[:-1]:
+            ax.tick_params(labelbottom=False)
+        fig.tight_layout()
+
     def plot_data(self, feature='phase', **kwargs):
         """
         Plots the input data.
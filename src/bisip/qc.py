@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author: charles
+# @Date:   2026-10-19
+# @Email:  charles@goldspot.ca
+# @Last modified by:   charles
+# @Last modified time: 2026-10-19
+
+
+import numpy as np
+
+from .models import Inversion
+
+
+def _impedance(data, ph_units='mrad'):
+    """Returns the frequencies, impedances and errors of stacked spectra.
+
+    Args:
+        data: An Inversion instance, or an array with the same columns as the
+            data files (freq, amp, pha, amp_err, pha_err), with shape (N, 5)
+            for a single spectrum or (n, N, 5) for a batch.
+        ph_units (:obj:`str`): The units of the phase shift measurements.
+            Ignored for Inversion instances. Defaults to 'mrad'.
+
+    Returns:
+        :obj:`tuple`: The angular frequencies, the complex impedances and the
+        errors of their real and imaginary parts, all with shape (n, N).
+
+    """
+    if isinstance(data, Inversion):
+        d = data.data
+        Z = d['zn'][0] + 1j*d['zn'][1]
+        Z_err = d['zn_err'][0] + 1j*d['zn_err'][1]
+        return d['w'][None], Z[None], Z_err[None]
+    data = np.asarray(data, dtype=float)
+    if data.ndim == 2:
+        data = data[None]
+    amp, pha = data[..., 1], data[..., 2]
+    amp_err, pha_err = data[..., 3], data[..., 4]
+    if ph_units == 'mrad':
+        pha, pha_err = pha/1000, pha_err/1000
+    elif ph_units == 'deg':
+        pha, pha_err = np.radians(pha), np.radians(pha_err)
+    # Same error propagation as in `utils.load_data`
+    EI = np.sqrt((amp*np.cos(pha)*pha_err)**2 + (np.sin(pha)*amp_err)**2)
+    ER = np.sqrt((amp*np.sin(pha)*pha_err)**2 + (np.cos(pha)*amp_err)**2)
+    return 2*np.pi*data[..., 0], amp*np.exp(1j*pha), ER + 1j*EI
+
+
+def kramers_kronig(data, ph_units='mrad', n_elements=None):
+    """Tests the Kramers-Kronig consistency of spectra with the Lin-KK method.
+
+    Every spectrum is fitted by a series resistance and `n_elements` Voigt
+    (parallel RC) elements with fixed, log-spaced time constants spanning the
+    inverse of the frequency range (Schönleber et al., 2014,
+    https://doi.org/10.1016/j.electacta.2014.01.034). This circuit satisfies
+    the Kramers-Kronig relations, so large residuals reveal measurements
+    that cannot come from a causal, linear and stable system. The fit is
+    linear and weighted by the measurement errors, and all the spectra of a
+    batch are solved at once.
+
+    Args:
+        data: An Inversion instance, or an array with the same columns as the
+            data files (freq, amp, pha, amp_err, pha_err), with shape (N, 5)
+            for a single spectrum or (n, N, 5) for a batch.
+        ph_units (:obj:`str`): The units of the phase shift measurements.
+            Ignored for Inversion instances. Defaults to 'mrad'.
+        n_elements (:obj:`int`): The number of Voigt elements. If None, half
+            of the number of frequencies is used, up to 50. Defaults to None.
+
+    Returns:
+        :obj:`dict`: A dict holding the residuals divided by the measurement
+        errors (`residuals`) with shape (n, 2, N) for the real and imaginary
+        parts, their mean square (`chi2`) with shape (n,), which is close to
+        1 for consistent spectra with correct errors, and the fitted
+        impedances (`fit`) with shape (n, N).
+
+    """
+    w, Z, Z_err = _impedance(data, ph_units)
+    n, N = Z.shape
+    if n_elements is None:
+        n_elements = max(1, min(N // 2, 50))
+
+    # Design matrices of the real and imaginary parts, shape (n, 2N, M+1)
+    w_min = w.min(axis=1, keepdims=True)
+    w_max = w.max(axis=1, keepdims=True)
+    frac = np.linspace(0, 1, n_elements)
+    taus = (1/w_max)*(w_max/w_min)**frac
+    K = 1/(1 + 1j*w[:, :, None]*taus[:, None, :])
+    A = np.concatenate([
+        np.concatenate([np.ones((n, N, 1)), K.real], axis=2),
+        np.concatenate([np.zeros((n, N, 1)), K.imag], axis=2)], axis=1)
+    y = np.concatenate([Z.real, Z.imag], axis=1)
+    sigma = np.concatenate([Z_err.real, Z_err.imag], axis=1)
+    weights = 1/sigma**2
+
+    # Weighted normal equations, solved for the whole batch
+    Aw = A.transpose(0, 2, 1)*weights[:, None, :]
+    G = Aw @ A
+    b = Aw @ y[..., None]
+    trace = np.trace(G, axis1=1, axis2=2)[:, None, None]
+    G = G + 1e-12*trace*np.eye(n_elements + 1)
+    x = np.linalg.solve(G, b)
+
+    fit = (A @ x)[..., 0]
+    residuals = ((y - fit)/sigma).reshape(n, 2, N)
+    return {'residuals': residuals,
+            'chi2': np.mean(residuals**2, axis=(1, 2)),
+            'fit': fit[:, :N] + 1j*fit[:, N:],
+            }
+
+
+def outlier_flags(residuals, threshold=3.5):
+    """Flags outlying measurements with a robust z-score of their residuals.
+
+    The z-score is computed from the median and the median absolute
+    deviation (MAD) of the residuals of every spectrum, so it is not inflated
+    by the outliers themselves. Since the residuals are divided by the
+    measurement errors, the scale is not allowed to fall below 1, so that
+    measurements within their error bars are never flagged.
+
+    Args:
+        residuals (:obj:`ndarray`): Residuals divided by the measurement
+            errors, with shape (n, 2, N), e.g. the `residuals` returned by
+            `kramers_kronig`.
+        threshold (:obj:`float`): The z-score above which a real or
+            imaginary residual is flagged. Defaults to 3.5.
+
+    Returns:
+        :obj:`ndarray`: A boolean array with shape (n, N), True for the
+        flagged frequencies.
+
+    """
+    med = np.median(residuals, axis=2, keepdims=True)
+    mad = np.median(np.abs(residuals - med), axis=2, keepdims=True)
+    scale = np.maximum(1.4826*mad, 1)
+    z = np.abs(residuals - med)/scale
+    return (z > threshold).any(axis=1)
+
+
+def screen(data, ph_units='mrad', max_chi2=5.0, threshold=3.5,
+           max_outliers=0.2, n_elements=None):
+    """Runs the pre-inversion quality control of spectra.
+
+    Spectra whose Kramers-Kronig residuals are too large, or which have too
+    many outlying measurements, are rejected so that no MCMC time is spent
+    on them. The flagged measurements of the accepted spectra can be
+    down-weighted with `downweight` before the fit.
+
+    Example:
+        Fitting only the spectra of a batch that pass the quality control::
+
+            qc = screen(spectra)
+            for data, flags in zip(spectra[qc['accept']],
+                                   qc['flags'][qc['accept']]):
+                model = PeltonColeCole(data)
+                downweight(model, flags)
+                model.fit()
+
+    Args:
+        data: An Inversion instance, or an array with the same columns as the
+            data files (freq, amp, pha, amp_err, pha_err), with shape (N, 5)
+            for a single spectrum or (n, N, 5) for a batch.
+        ph_units (:obj:`str`): The units of the phase shift measurements.
+            Ignored for Inversion instances. Defaults to 'mrad'.
+        max_chi2 (:obj:`float`): The maximum mean square of the
+            Kramers-Kronig residuals, divided by the measurement errors, of an
+            accepted spectrum. Defaults to 5.
+        threshold (:obj:`float`): The modified z-score above which a
+            measurement is flagged (see `outlier_flags`). Defaults to 3.5.
+        max_outliers (:obj:`float`): The maximum fraction of flagged
+            measurements of an accepted spectrum. Defaults to 0.2.
+        n_elements (:obj:`int`): The number of Voigt elements of the
+            Kramers-Kronig test (see `kramers_kronig`). Defaults to None.
+
+    Returns:
+        :obj:`dict`: A dict holding whether each spectrum is accepted
+        (`accept`, shape (n,)), the flagged measurements (`flags`, shape
+        (n, N)), the mean square of the Kramers-Kronig residuals (`chi2`) and
+        the residuals themselves (`residuals`).
+
+    """
+    kk = kramers_kronig(data, ph_units, n_elements)
+    flags = outlier_flags(kk['residuals'], threshold)
+    accept = (kk['chi2'] <= max_chi2) & (flags.mean(axis=1) <= max_outliers)
+    return {'accept': accept,
+            'flags': flags,
+            'chi2': kk['chi2'],
+            'residuals': kk['residuals'],
+            }
+
+
+def downweight(model, flags, factor=10.0):
+    """Inflates the errors of flagged measurements before a fit.
+
+    Args:
+        model (:obj:`Inversion`): The model to fit.
+        flags (:obj:`ndarray`): A boolean array with shape (N,), True for the
+            measurements to down-weight, e.g. a row of the `flags` returned
+            by `screen`.
+        factor (:obj:`float`): The factor by which the errors of the flagged
+            measurements are multiplied. Defaults to 10.
+
+    """
+    scale = np.where(np.asarray(flags, dtype=bool), factor, 1.0)
+    model.data['zn_err'] = model.data['zn_err']*scale
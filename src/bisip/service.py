@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author: charles
+# @Date:   2026-10-19
+# @Email:  charles@goldspot.ca
+# @Last modified by:   charles
+# @Last modified time: 2026-10-19
+
+
+import asyncio
+import itertools
+import json
+import multiprocessing
+import queue
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from . import models
+from .utils import seed_sequence, spectrum_seed
+
+
+class JobCancelled(Exception):
+    """Raised in a worker process when its inversion is cancelled. """
+
+
+def _run_job(job_id, model_name, data, model_kwargs, fit_kwargs, discard,
+             progress_every, events, cancelled):
+    """Fits one spectrum in a worker process and returns its summary. """
+    model = getattr(models, model_name)(data, **model_kwargs)
+
+    def callback(step):
+        if cancelled.is_set():
+            raise JobCancelled(job_id)
+        if step % progress_every == 0:
+            events.put({'job_id': job_id, 'status': 'running',
+                        'step': step, 'nsteps': model.nsteps})
+
+    model.fit(progress=False, callback=callback, **fit_kwargs)
+    if discard is None:
+        discard = model.nsteps // 2
+    return {'job_id': job_id,
+            'status': 'done',
+            'param_names': model.param_names,
+            'mean': model.get_param_mean(discard=discard).tolist(),
+            'std': model.get_param_std(discard=discard).tolist(),
+            'acceptance': float(np.mean(model.sampler.acceptance_fraction)),
+            'seed': model.seed,
+            }
+
+
+class InversionService(object):
+    """An asyncio service to run inversions of spectra on demand.
+
+    Spectra are submitted as in-memory arrays and queued. A bounded queue
+    provides backpressure to the submitters, and a fixed number of
+    dispatchers run the inversions on a process pool. Progress updates and
+    final summaries are streamed to the clients with the `events` method.
+    The worker processes are started like with the 'forkserver' method of
+    multiprocessing, so scripts starting the service must guard their entry
+    point with ``if __name__ == '__main__':``.
+
+    Args:
+        model (:obj:`str`): The name of the inversion model class, e.g.
+            'PolynomialDecomposition'. Defaults to 'PolynomialDecomposition'.
+        model_kwargs (:obj:`dict`): Keyword arguments passed to the model
+            class (e.g. nwalkers, nsteps, poly_deg). Defaults to None.
+        fit_kwargs (:obj:`dict`): Keyword arguments passed to the fit method
+            (e.g. moves). Defaults to None.
+        max_workers (:obj:`int`): The number of worker processes. If None,
+            the number of CPUs is used. Defaults to None.
+        max_queue (:obj:`int`): The maximum number of queued spectra before
+            submitters have to wait. Defaults to 100.
+        discard (:obj:`int`): The number of burn-in steps discarded from the
+            summaries. If None, half of the steps are discarded. Defaults to
+            None.
+        progress_every (:obj:`int`): The number of MCMC steps between two
+            progress updates. Defaults to 100.
+        seed: The random seed of the service (see `utils.seed_sequence`).
+            The seed of every job is derived from it and from the job
+            identifier, and is recorded in the final update. Defaults to
+            None.
+
+    """
+
+    def __init__(self, model='PolynomialDecomposition', model_kwargs=None,
+                 fit_kwargs=None, max_workers=None, max_queue=100,
+                 discard=None, progress_every=100, seed=None):
+        self.model = model
+        self.model_kwargs = model_kwargs or {}
+        self.fit_kwargs = fit_kwargs or {}
+        self.max_workers = max_workers or multiprocessing.cpu_count()
+        self.max_queue = max_queue
+        self.discard = discard
+        self.progress_every = progress_every
+        self.seed_sequence = seed_sequence(seed)
+
+        self._ids = itertools.count()
+        self._jobs = {}
+        self._queue = None
+        self._tasks = []
+        self._executor = None
+        self._manager = None
+        self._events = None
+
+    async def start(self):
+        """Starts the worker processes and the dispatchers. """
+        # Worker processes forked from this process would inherit the client
+        # sockets and keep them open, so they are started from a server
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('forkserver')
+        else:
+            context = multiprocessing.get_context()
+        self._manager = context.Manager()
+        self._events = self._manager.Queue()
+        self._executor = ProcessPoolExecutor(self.max_workers,
+                                             mp_context=context)
+        self._queue = asyncio.Queue(self.max_queue)
+        self._tasks = [asyncio.ensure_future(self._dispatch())
+                       for _ in range(self.max_workers)]
+        self._tasks.append(asyncio.ensure_future(self._relay()))
+
+    async def stop(self):
+        """Cancels pending work and shuts the worker processes down. """
+        for job_id in list(self._jobs):
+            self.cancel(job_id)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        # Wait for the worker processes without blocking the event loop
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self._executor.shutdown, True)
+        await loop.run_in_executor(None, self._manager.shutdown)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def submit(self, data, job_id=None):
+        """Queues a spectrum for inversion.
+
+        Waits for a free slot if the queue is full.
+
+        Args:
+            data (:obj:`ndarray`): An array with the same columns as the data
+                files (freq, amp, pha, amp_err, pha_err).
+            job_id (:obj:`str`): An identifier for the job. If None, a number
+                is assigned. The identifier of a finished job can be reused.
+                Defaults to None.
+
+        Returns:
+            The job identifier.
+
+        Raises:
+            ValueError: If a queued or running job has the same identifier.
+
+        """
+        if job_id is None:
+            job_id = next(self._ids)
+            while job_id in self._jobs:
+                job_id = next(self._ids)
+        job = self._jobs.get(job_id)
+        if job is not None and job['status'] in ('queued', 'running'):
+            raise ValueError(f'Duplicate job ID: {job_id}')
+        loop = asyncio.get_event_loop()
+        job = {'job_id': job_id,
+               'status': 'queued',
+               'events': asyncio.Queue(),
+               'result': loop.create_future(),
+               'cancelled': self._manager.Event(),
+               }
+        self._jobs[job_id] = job
+        self._emit(job, {'job_id': job_id, 'status': 'queued'})
+        await self._queue.put((job, np.asarray(data, dtype=float)))
+        return job_id
+
+    def cancel(self, job_id):
+        """Cancels a queued or running inversion.
+
+        Args:
+            job_id: The job identifier returned by `submit`.
+
+        """
+        job = self._jobs.get(job_id)
+        if job is not None and job['status'] in ('queued', 'running'):
+            job['cancelled'].set()
+            if job['status'] == 'queued':
+                self._finish(job, {'job_id': job_id, 'status': 'cancelled'})
+
+    async def events(self, job_id):
+        """Streams the progress updates of a job until it is finished.
+
+        Args:
+            job_id: The job identifier returned by `submit`.
+
+        Yields:
+            :obj:`dict`: Updates with a `status` key, which is one of
+            'queued', 'running', 'done', 'cancelled' or 'failed'. The final
+            update of a 'done' job holds the parameter names, means and
+            standard deviations.
+
+        """
+        events = self._jobs[job_id]['events']
+        while True:
+            event = await events.get()
+            yield event
+            if event['status'] in ('done', 'cancelled', 'failed'):
+                break
+
+    async def result(self, job_id):
+        """Waits for a job to finish and returns its final update. """
+        return await self._jobs[job_id]['result']
+
+    def _emit(self, job, event):
+        job['events'].put_nowait(event)
+
+    def _finish(self, job, event):
+        job['status'] = event['status']
+        self._emit(job, event)
+        if not job['result'].done():
+            job['result'].set_result(event)
+
+    async def _dispatch(self):
+        """Runs the queued jobs on the process pool, one at a time. """
+        loop = asyncio.get_event_loop()
+        while True:
+            job, data = await self._queue.get()
+            job_id = job['job_id']
+            try:
+                if job['status'] != 'queued':
+                    continue
+                job['status'] = 'running'
+                model_kwargs = dict(self.model_kwargs, seed=spectrum_seed(
+                    self.seed_sequence, job_id))
+                future = loop.run_in_executor(
+                    self._executor, _run_job, job_id, self.model, data,
+                    model_kwargs, self.fit_kwargs, self.discard,
+                    self.progress_every, self._events, job['cancelled'])
+                try:
+                    event = await future
+                except JobCancelled:
+                    event = {'job_id': job_id, 'status': 'cancelled'}
+                except asyncio.CancelledError:
+                    job['cancelled'].set()
+                    raise
+                except Exception as e:
+                    event = {'job_id': job_id, 'status': 'failed',
+                             'error': repr(e)}
+                self._finish(job, event)
+            finally:
+                self._queue.task_done()
+
+    async def _relay(self):
+        """Relays the progress updates of the workers to the clients. """
+        loop = asyncio.get_event_loop()
+
+        def get():
+            try:
+                return self._events.get(timeout=0.1)
+            except queue.Empty:
+                return None
+
+        while True:
+            event = await loop.run_in_executor(None, get)
+            if event is not None:
+                job = self._jobs.get(event['job_id'])
+                if job is not None and job['status'] == 'running':
+                    self._emit(job, event)
+
+    async def serve(self, host='127.0.0.1', port=8765):
+        """Serves the inversions over a socket with a JSON lines protocol.
+
+        Every line sent by a client is a JSON object. Send
+        ``{"id": ..., "data": [[freq, amp, pha, amp_err, pha_err], ...]}`` to
+        submit a spectrum, or ``{"cancel": id}`` to cancel one. The updates of
+        the submitted jobs are written back as JSON lines.
+
+        Args:
+            host (:obj:`str`): The interface to listen on. Defaults to
+                '127.0.0.1'.
+            port (:obj:`int`): The port to listen on. Defaults to 8765.
+
+        Returns:
+            :obj:`asyncio.AbstractServer`: The running server.
+
+        """
+        return await asyncio.start_server(self._handle, host, port)
+
+    async def _handle(self, reader, writer):
+        lock = asyncio.Lock()
+        streams = []
+
+        async def stream(job_id):
+            async for event in self.events(job_id):
+                async with lock:
+                    writer.write((json.dumps(event) + '\n').encode())
+                    await writer.drain()
+
+        try:
+            async for line in reader:
+                request = json.loads(line)
+                if 'cancel' in request:
+                    self.cancel(request['cancel'])
+                    continue
+                try:
+                    job_id = await self.submit(request['data'],
+                                               request.get('id'))
+                except ValueError as e:
+                    async with lock:
+                        writer.write((json.dumps(
+                            {'job_id': request.get('id'), 'status': 'failed',
+                             'error': str(e)}) + '\n').encode())
+                        await writer.drain()
+                    continue
+                streams.append(asyncio.ensure_future(stream(job_id)))
+            await asyncio.gather(*streams)
+        finally:
+            writer.close()
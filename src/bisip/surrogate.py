@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author: charles
+# @Date:   2026-10-19
+# @Email:  charles@goldspot.ca
+# @Last modified by:   charles
+# @Last modified time: 2026-10-19
+
+
+import itertools
+import warnings
+
+import emcee
+import numpy as np
+
+from .models import Inversion
+
+
+class SurrogateLogProbability(object):
+    """The vectorized surrogate log-probability of a model.
+
+    It holds the surrogate and copies of the data, bounds and likelihood
+    settings of the model, rather than the model itself, so that it can be
+    pickled with the moves of a fitted model.
+
+    Args:
+        surrogate (:obj:`ForwardSurrogate`): The trained surrogate.
+        model (:obj:`Inversion`): The model to fit.
+
+    """
+
+    def __init__(self, surrogate, model):
+        self.surrogate = surrogate
+        self.bounds = model.param_bounds
+        self.transform = model.transform
+        self.likelihood = model.likelihood
+        self.nu = model.nu
+        self.y = model.data['zn']
+        self.sigma2 = model.data['zn_err']**2
+        self.const = np.sum(2*np.log(self.sigma2))
+
+    def _misfit(self, chi2, axis=None):
+        return Inversion._misfit(self, chi2, axis)
+
+    def __call__(self, coords):
+        coords = np.atleast_2d(coords)
+        bounds = self.bounds
+        log_jac = 0
+        theta = coords
+        if self.transform:
+            theta = Inversion._from_unbounded(self, coords, bounds)
+            log_jac = np.sum(np.log(bounds[1] - bounds[0])
+                             - np.logaddexp(0, coords)
+                             - np.logaddexp(0, -coords), axis=1)
+        inside = ((bounds[0] < theta) & (theta < bounds[1])).all(axis=1)
+        lp = np.full(theta.shape[0], -np.inf)
+        Z = self.surrogate.forward_batch(theta[inside])
+        lp[inside] = -0.5*(self._misfit((self.y - Z)**2 / self.sigma2,
+                                        axis=(1, 2)) + self.const)
+        return lp + log_jac
+
+
+class ForwardSurrogate(object):
+    """A cheap polynomial emulator of the forward model of an Inversion.
+
+    The impedance is approximated by a total-degree Chebyshev polynomial of
+    the parameters, scaled to [-1, 1] over the training domain, and fitted
+    by least squares to forward evaluations at random parameter values. The
+    surrogate only depends on the model hyperparameters and on the frequency
+    grid, so a single trained surrogate can be reused for every spectrum
+    measured at the same frequencies.
+
+    A low-degree polynomial cannot follow the forward model over the full
+    parameter bounds, so the surrogate is only accurate enough to sample
+    from once it is trained on parameter values near the posterior, e.g.
+    a short pilot chain passed as `thetas`. Compare `rms_error` with the
+    data errors before relying on it.
+
+    Args:
+        model (:obj:`Inversion`): The model to emulate. Its `forward_batch`
+            method, parameter bounds and angular frequencies are used for
+            the training.
+        degree (:obj:`int`): The total degree of the polynomial. Defaults
+            to 3.
+        n_samples (:obj:`int`): The number of training samples. If None, ten
+            times the number of polynomial terms is used. Defaults to None.
+        seed (:obj:`int`): Seed of the training samples. Defaults to None.
+        thetas (:obj:`ndarray`): Parameter values to train on, with shape
+            (n, ndim), e.g. a flattened pilot chain. The polynomial is then
+            scaled to the range of these values, which is much more accurate
+            than a fit over the full parameter bounds. If None, `n_samples`
+            values are uniformly drawn from the parameter bounds. Defaults to
+            None.
+
+    """
+
+    def __init__(self, model, degree=3, n_samples=None, seed=None,
+                 thetas=None):
+        self.degree = degree
+        self.w = model.data['w']
+
+        ndim = model.param_bounds.shape[1]
+        # One exponent vector per multiset of at most `degree` parameters
+        self._powers = np.array([
+            np.bincount(c, minlength=ndim).astype(int)
+            for k in range(degree+1)
+            for c in itertools.combinations_with_replacement(range(ndim), k)
+        ]).reshape(-1, ndim)
+        if n_samples is None:
+            n_samples = 10*len(self._powers)
+
+        if thetas is None:
+            rng = np.random.default_rng(seed)
+            thetas = rng.uniform(*model.param_bounds, (n_samples, ndim))
+            self.bounds = model.param_bounds
+        else:
+            self.bounds = np.array([thetas.min(axis=0), thetas.max(axis=0)])
+        n_samples = thetas.shape[0]
+        Z = model.forward_batch(thetas, self.w).reshape(n_samples, -1)
+        X = self._features(thetas)
+        self._coeffs = np.linalg.lstsq(X, Z, rcond=None)[0]
+        self.rms_error = np.sqrt(np.mean((X @ self._coeffs - Z)**2))
+
+    def _features(self, thetas):
+        """Returns the Chebyshev polynomial terms of the parameters. """
+        lo, hi = self.bounds
+        x = 2*(thetas - lo) / np.where(hi > lo, hi - lo, 1) - 1
+        T = np.empty((self.degree+1,) + x.shape)
+        T[0] = 1
+        if self.degree > 0:
+            T[1] = x
+        for k in range(2, self.degree+1):
+            T[k] = 2*x*T[k-1] - T[k-2]
+        X = np.ones((x.shape[0], len(self._powers)))
+        for d in range(x.shape[1]):
+            X *= T[self._powers[:, d], :, d].T
+        return X
+
+    def forward_batch(self, thetas):
+        """Returns the emulated impedances of many parameter vectors.
+
+        Args:
+            thetas (:obj:`ndarray`): A 2D array of parameter values with shape
+                (n, ndim).
+
+        Returns:
+            :obj:`ndarray`: The impedances, with shape (n, 2, N).
+
+        """
+        Z = self._features(thetas) @ self._coeffs
+        return Z.reshape(thetas.shape[0], 2, -1)
+
+    def log_probability(self, model):
+        """Returns a vectorized surrogate log-probability for a model.
+
+        Args:
+            model (:obj:`Inversion`): The model to fit. Its frequencies must
+                match the ones the surrogate was trained on.
+
+        Returns:
+            :obj:`SurrogateLogProbability`: A picklable function of the
+            walker coordinates with shape (n, ndim) returning their
+            approximate log-probabilities. If the model samples transformed
+            parameters, the coordinates are transformed ones.
+
+        """
+        if not np.array_equal(model.data['w'], self.w):
+            raise ValueError('The surrogate was trained on a different '
+                             'frequency grid.')
+        return SurrogateLogProbability(self, model)
+
+    def burn_in(self, model, nsteps, p0=None):
+        """Runs a burn-in period on the surrogate posterior only.
+
+        Args:
+            model (:obj:`Inversion`): The model to fit.
+            nsteps (:obj:`int`): The number of burn-in steps.
+            p0 (:obj:`ndarray`): Starting parameter values with shape
+                (nwalkers, ndim). If None, random values are uniformly drawn
+                from the parameter bounds. Defaults to None.
+
+        Returns:
+            :obj:`ndarray`: The final positions of the walkers, in the
+            original parameter space, to pass as `p0` to the fit method.
+
+        Warns:
+            UserWarning: If the training error of the surrogate exceeds the
+                RMS error of the data, in which case the burn-in moves the
+                walkers towards the wrong posterior. Train the surrogate on
+                `thetas` near the posterior instead.
+
+        """
+        zn_err = np.sqrt(np.mean(model.data['zn_err']**2))
+        if self.rms_error > zn_err:
+            warnings.warn(('The surrogate RMS error ({:.3g}) exceeds the RMS '
+                           'error of the data ({:.3g}). Train it on `thetas` '
+                           'near the posterior, e.g. a short pilot chain, '
+                           'before using it for the burn-in.'
+                           ).format(self.rms_error, zn_err))
+        bounds = model.param_bounds
+        rng, random_state = model._random_streams()
+        if p0 is None:
+            p0 = rng.uniform(*bounds, (model.nwalkers, bounds.shape[1]))
+        if model.transform:
+            p0 = model._to_unbounded(p0, bounds)
+        sampler = emcee.EnsembleSampler(model.nwalkers, bounds.shape[1],
+                                        self.log_probability(model),
+                                        vectorize=True)
+        sampler.random_state = random_state.get_state()
+        state = sampler.run_mcmc(p0, nsteps)
+        if model.transform:
+            return model._from_unbounded(state.coords, bounds)
+        return state.coords
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author: charles
+# @Date:   2026-10-19
+# @Email:  charles@goldspot.ca
+# @Last modified by:   charles
+# @Last modified time: 2026-10-19
+
+
+import os
+
+import numpy as np
+
+from . import models
+from .utils import seed_sequence, spectrum_seed
+
+
+HEADER = 'freq, amp, pha, amp_err, pha_err'
+
+
+def frequencies(n_freq=20, f_min=1e-2, f_max=6e3):
+    """Returns a log-spaced frequency grid, in decreasing order.
+
+    Args:
+        n_freq (:obj:`int`): The number of frequencies. Defaults to 20.
+        f_min (:obj:`float`): The lowest frequency, in Hz. Defaults to 1e-2.
+        f_max (:obj:`float`): The highest frequency, in Hz. Defaults to 6e3.
+
+    Returns:
+        :obj:`ndarray`: The frequencies, like the ones of the data files.
+
+    """
+    return np.geomspace(f_max, f_min, n_freq)
+
+
+def _grid_model(model, freq, model_kwargs):
+    """Instantiates a model on a frequency grid without measurements. """
+    if isinstance(model, str):
+        model = getattr(models, model)
+    ones = np.ones_like(freq)
+    data = np.column_stack([freq, ones, 0*ones, ones, ones])
+    return model(data, **model_kwargs)
+
+
+def iter_spectra(model, n_spectra, chunk_size=1000, freq=None, n_freq=20,
+                 bounds=None, thetas=None, amplitude=3e4, amp_noise=0.03,
+                 pha_noise=2.0, seed=None, model_kwargs=None):
+    """Generates noisy synthetic spectra in chunks.
+
+    The spectra are drawn chunk by chunk, so that arbitrarily large datasets
+    can be streamed to disk or to a batch inversion without holding them in
+    memory. See `make_spectra` for a description of the arguments.
+
+    Args:
+        chunk_size (:obj:`int`): The number of spectra per chunk. Defaults to
+            1000.
+
+    Yields:
+        :obj:`dict`: Chunks of spectra, with the same keys as the output of
+        `make_spectra`.
+
+    """
+    if freq is None:
+        freq = frequencies(n_freq)
+    freq = np.asarray(freq, dtype=float)
+    inv = _grid_model(model, freq, model_kwargs or {})
+    w = inv.data['w']
+    if bounds is None:
+        bounds = inv.param_bounds
+    bounds = np.asarray(bounds, dtype=float)
+    ss = seed_sequence(seed)
+
+    for start in range(0, n_spectra, chunk_size):
+        n = min(chunk_size, n_spectra - start)
+        # Every spectrum has its own random stream, so it does not depend
+        # on the chunk size
+        rngs = [np.random.default_rng(spectrum_seed(ss, i))
+                for i in range(start, start + n)]
+        if thetas is None:
+            params = np.array([r.uniform(*bounds) for r in rngs])
+        else:
+            params = np.asarray(thetas, dtype=float)[start:start+n]
+
+        Z = inv.forward_batch(params, w)
+        Z = Z[:, 0] + 1j*Z[:, 1]
+        amp = amplitude*np.abs(Z)
+        pha = 1000*np.angle(Z)  # rad to mrad
+        amp_err = amp_noise*amp
+        pha_err = np.full_like(pha, pha_noise)
+        noise = np.array([r.standard_normal((2, freq.shape[0]))
+                          for r in rngs])
+        amp = amp + amp_err*noise[:, 0]
+        pha = pha + pha_err*noise[:, 1]
+
+        data = np.stack([np.broadcast_to(freq, amp.shape), amp, pha,
+                         amp_err, pha_err], axis=-1)
+        yield {'data': data,
+               'params': params,
+               'param_names': inv.param_names,
+               'seed': {'entropy': ss.entropy,
+                        'spawn_key': list(ss.spawn_key)},
+               }
+
+
+def make_spectra(model, n_spectra, freq=None, n_freq=20, bounds=None,
+                 thetas=None, amplitude=3e4, amp_noise=0.03, pha_noise=2.0,
+                 seed=None, model_kwargs=None):
+    """Generates noisy synthetic spectra of an inversion model.
+
+    True parameters are uniformly drawn from the parameter bounds of the
+    model and evaluated with its `forward_batch` method. Gaussian noise is
+    added to the amplitude (relative) and to the phase (absolute), and the
+    standard deviations of the noise are reported as the data errors.
+
+    Example:
+        Fitting the first of 10000 synthetic spectra with 500 frequencies::
+
+            spectra = make_spectra('PeltonColeCole', 10000, n_freq=500)
+            model = PeltonColeCole(spectra['data'][0])
+            model.fit()
+
+    Args:
+        model (:obj:`str` or :obj:`type`): The inversion model class, or
+            its name, e.g. 'PeltonColeCole'.
+        n_spectra (:obj:`int`): The number of spectra.
+        freq (:obj:`ndarray`): The frequencies, in Hz. If None, `n_freq`
+            frequencies are log-spaced like the ones of the data files.
+            Defaults to None.
+        n_freq (:obj:`int`): The number of frequencies if `freq` is None.
+            Defaults to 20.
+        bounds (:obj:`ndarray`): The bounds of the true parameters, with
+            shape (2, ndim). If None, the parameter bounds of the model are
+            used. Defaults to None.
+        thetas (:obj:`ndarray`): True parameters to use instead of random
+            ones, with shape (n_spectra, ndim). Defaults to None.
+        amplitude (:obj:`float`): The amplitude (resistivity) scale of the
+            spectra. Defaults to 3e4.
+        amp_noise (:obj:`float`): The relative standard deviation of the
+            amplitude noise. Defaults to 0.03.
+        pha_noise (:obj:`float`): The standard deviation of the phase noise,
+            in mrad. Defaults to 2.0.
+        seed: The random seed (see `utils.seed_sequence`). The spectrum i
+            is generated from `utils.spectrum_seed(seed, i)`. Defaults to
+            None.
+        model_kwargs (:obj:`dict`): Keyword arguments passed to the model
+            class (e.g. n_modes, poly_deg). Defaults to None.
+
+    Returns:
+        :obj:`dict`: The stacked spectra (`data`) with shape
+        (n_spectra, N, 5) and the same columns as the data files (freq, amp,
+        pha in mrad, amp_err, pha_err), the true parameters (`params`), the
+        parameter names (`param_names`) and the random seed (`seed`).
+
+    """
+    chunks = list(iter_spectra(model, n_spectra, max(n_spectra, 1), freq,
+                               n_freq, bounds, thetas, amplitude, amp_noise,
+                               pha_noise, seed, model_kwargs))
+    return {'data': np.concatenate([c['data'] for c in chunks]),
+            'params': np.concatenate([c['params'] for c in chunks]),
+            'param_names': chunks[0]['param_names'],
+            'seed': chunks[0]['seed'],
+            }
+
+
+def save_spectra(dirpath, spectra, names=None, start=0):
+    """Writes synthetic spectra to data files.
+
+    The files can be read with the `filepath` argument of the models, with
+    the default `headers` and `ph_units`. The true parameters are written
+    to a `params.csv` file in the same directory.
+
+    Args:
+        dirpath (:obj:`str`): The directory in which to save the files. It is
+            created if it does not exist.
+        spectra (:obj:`dict`): The output of `make_spectra`, or a chunk
+            yielded by `iter_spectra`.
+        names (:obj:`list`): The file names, without extension. If None, the
+            spectra are named SYN-000000, SYN-000001, etc. Defaults to None.
+        start (:obj:`int`): The index of the first spectrum in the default
+            names, to save successive chunks. Defaults to 0.
+
+    Returns:
+        :obj:`list`: The paths to the data files.
+
+    """
+    os.makedirs(dirpath, exist_ok=True)
+    n = spectra['data'].shape[0]
+    if names is None:
+        names = [f'SYN-{i:06d}' for i in range(start, start + n)]
+    paths = []
+    for name, data in zip(names, spectra['data']):
+        path = os.path.join(dirpath, f'{name}.dat')
+        np.savetxt(path, data, delimiter=',', header=HEADER, comments='')
+        paths.append(path)
+
+    params_path = os.path.join(dirpath, 'params.csv')
+    with open(params_path, 'a') as f:
+        if f.tell() == 0:
+            f.write(', '.join(['name'] + spectra['param_names']) + '\n')
+        for name, p in zip(names, spectra['params']):
+            f.write(', '.join([name] + [f'{x:.18e}' for x in p]) + '\n')
+    return paths
@@ -7,14 +7,65 @@
 # @Last modified time: 2020-03-18T16:01:58-04:00
 
 
+import asyncio
+import json
+import logging
 import os
+import tempfile
+import threading
+import time
 import warnings
 
+import emcee
 import numpy as np
 import matplotlib.pyplot as plt
 
 import bisip
 from bisip import PolynomialDecomposition, PeltonColeCole, Dias2000
+from bisip import Shin2015
+from bisip.synthetic import make_spectra
+from bisip.distributed import Coordinator, Worker, SQLiteTransport, fit_task
+from bisip.service import InversionService
+
+
+# Posterior medians and 16th and 84th percentiles of the regression cases.
+# Every case was fitted 12 times with 20000 steps and 32 walkers: 6 times
+# with the emcee StretchMove and 6 times with the `default_moves` mixture
+# (random seeds 1 to 6). The second halves of the chains were pooled, without
+# the stuck walkers (see `_sampled_walkers`). The two engines agree to within
+# 0.04 half-widths of the 68% intervals. For the PeltonColeCole and Shin2015
+# cases, the StretchMove results also agree to within 0.03 half-widths with
+# long Gaussian random-walk Metropolis chains.
+REFERENCES = {
+    'PolynomialDecomposition': {
+        'median': [0.997051, 0.00688985, -0.00391408, -0.00135525, 0.000728018,
+                   0.000217104],
+        'p16': [0.989525, 0.00651262, -0.00443049, -0.00167042, 0.000497276,
+                0.000181093],
+        'p84': [1.00455, 0.0072702, -0.0033947, -0.00104384, 0.000956582,
+                0.000252834],
+    },
+    'PeltonColeCole': {
+        'median': [1.05922, 0.645334, -14.5093, 0.119474],
+        'p16': [1.0497, 0.612094, -14.8735, 0.114048],
+        'p84': [1.06923, 0.666148, -13.773, 0.125164],
+    },
+    'Dias2000': {
+        'median': [1.00065, 0.311424, -9.54975, 8.09813, 0.551049],
+        'p16': [0.995319, 0.299783, -9.64202, 7.65189, 0.530221],
+        'p84': [1.006, 0.324033, -9.45801, 8.57075, 0.572413],
+    },
+    'Shin2015': {
+        'median': [0.0036089, 0.953427, -13.9998, -5.0077, 0.500927, 0.316713],
+        'p16': [0.000907362, 0.945893, -14.6797, -5.02044, 0.160308, 0.314115],
+        'p84': [0.00961777, 0.959745, -13.3189, -5.00192, 0.840054, 0.319481],
+    },
+    'PeltonColeCole-synthetic': {
+        'median': [1.01129, 0.29932, -3.00966, 0.500548],
+        'p16': [1.00986, 0.298524, -3.01975, 0.498842],
+        'p84': [1.01273, 0.30012, -2.99966, 0.502251],
+    },
+}
 
 
 def run_test(dias=True, colecole=True, debye=True):
@@ -98,3 +149,279 @@ def run_test(dias=True, colecole=True, debye=True):
 
     print('All tests passed. Press ctrl+C or close figure windows to exit.')
     plt.show()
+
+
+def _regression_cases():
+    """Returns the model, data and settings of the regression cases. """
+    fp = os.path.join(os.path.dirname(bisip.__file__), 'data/SIP-K389175.dat')
+    # A synthetic spectrum of known parameters, with low noise
+    truth = [1.0, 0.3, -3.0, 0.5]
+    synthetic = make_spectra(PeltonColeCole, 1, thetas=[truth], n_freq=40,
+                             amp_noise=0.01, pha_noise=0.5, seed=2026)
+    data = synthetic['data'][0]
+    # The data are normalized by their maximum amplitude, noise included
+    truth[0] *= 3e4 / data[:, 1].max()
+    return {
+        'PolynomialDecomposition': (PolynomialDecomposition, fp,
+                                    {'poly_deg': 4, 'nsteps': 2000}, None),
+        'PeltonColeCole': (PeltonColeCole, fp,
+                           {'n_modes': 1, 'nsteps': 3000}, None),
+        'Dias2000': (Dias2000, fp, {'nsteps': 4000}, None),
+        'Shin2015': (Shin2015, fp, {'nsteps': 12000}, None),
+        'PeltonColeCole-synthetic': (PeltonColeCole, data,
+                                     {'n_modes': 1, 'nsteps': 3000}, truth),
+    }
+
+
+def _sampled_walkers(model, discard, max_drop=10):
+    """Flags the walkers that sample the posterior, i.e. are not stuck.
+
+    Walkers started far from the posterior mass may linger in
+    low-probability regions for thousands of steps. A walker whose median
+    log-probability is more than `max_drop` below the median over all the
+    walkers is considered stuck.
+    """
+    lp = np.median(model.sampler.get_log_prob(discard=discard), axis=0)
+    return lp > np.median(lp) - max_drop
+
+
+def run_regression(cases=None, fit_kwargs=None, tol=0.5, max_stuck=0.25,
+                   seed=0, verbose=True, raise_on_failure=True):
+    """Checks that the fitted posteriors match reference results.
+
+    Every model is fitted to a bundled data file, and the Pelton ColeCole
+    model is also fitted to a synthetic spectrum with known parameters. The
+    posterior median and the 16th and 84th percentiles of every parameter
+    must match the reference values to within `tol` times the half-width of
+    the reference 68% interval, and the true parameters of the synthetic
+    spectrum must fall within the 95% interval. The stuck walkers, which
+    may linger in low-probability regions for thousands of steps, are left
+    out of the percentiles and of the effective sample size, and a case
+    fails if more than a `max_stuck` fraction of its walkers is stuck. The
+    number of steps of every case is set so
+    that the Monte Carlo error of a StretchMove fit is about 0.1 half-width
+    (at most 0.25 over 10 to 20 seeds), half of the default tolerance. The
+    time-to-solution and the effective samples per second are recorded for
+    every case, so that a faster engine can be accepted only if it still
+    passes.
+
+    Example:
+        Validating the vectorized log-probability::
+
+            report = run_regression(fit_kwargs={'vectorize': True})
+            print(report['Dias2000']['ess_per_sec'])
+
+    Args:
+        cases (:obj:`list` of :obj:`str`): The names of the cases to run. If
+            None, all cases in `REFERENCES` are run. Defaults to None.
+        fit_kwargs (:obj:`dict`): Keyword arguments passed to the fit
+            methods, e.g. to test other engines. By default, the models are
+            fitted with the emcee `StretchMove`. Defaults to None.
+        tol (:obj:`float`): The tolerance, in reference half-widths of the
+            68% interval. Defaults to 0.5.
+        max_stuck (:obj:`float`): The largest fraction of stuck walkers
+            allowed in a case. Defaults to 0.25.
+        seed: The random seed of the fits. Defaults to 0.
+        verbose (:obj:`bool`): Whether to print the results. Defaults to
+            True.
+        raise_on_failure (:obj:`bool`): Whether to raise an AssertionError
+            if a case fails. Defaults to True.
+
+    Returns:
+        :obj:`dict`: The results of every case, holding whether it passed
+        (`passed`), the failed checks (`failures`), the posterior
+        percentiles (`median`, `p16`, `p84`), the number of stuck walkers
+        left out (`n_stuck`), the time-to-solution in seconds (`time`) and
+        the effective samples per second of the other walkers
+        (`ess_per_sec`).
+
+    """
+    all_cases = _regression_cases()
+    if cases is None:
+        cases = list(REFERENCES)
+    fit_kwargs = dict({'progress': False}, **(fit_kwargs or {}))
+
+    report = {}
+    for name in cases:
+        model_class, data, model_kwargs, truth = all_cases[name]
+        ref = REFERENCES[name]
+        model = model_class(data, seed=seed, **model_kwargs)
+        t0 = time.perf_counter()
+        model.fit(**fit_kwargs)
+        elapsed = time.perf_counter() - t0
+
+        discard = model.nsteps // 2
+        walkers = _sampled_walkers(model, discard)
+        n_stuck = int(np.sum(~walkers))
+        chain = model.get_chain(discard=discard)[:, walkers]
+        # emcee warns about short chains through logging, not warnings
+        logger = logging.getLogger('emcee.autocorr')
+        level = logger.level
+        logger.setLevel(logging.ERROR)
+        try:
+            tau = emcee.autocorr.integrated_time(chain, quiet=True)
+        finally:
+            logger.setLevel(level)
+        ess_per_sec = np.prod(chain.shape[:2]) / np.nanmax(tau) / elapsed
+
+        chain = chain.reshape(-1, chain.shape[-1])
+        p2, p16, p50, p84, p97 = np.percentile(chain, [2.5, 16, 50, 84, 97.5],
+                                               axis=0)
+        scale = tol*(np.array(ref['p84']) - np.array(ref['p16']))/2
+        failures = []
+        if n_stuck > max_stuck*walkers.size:
+            failures.append(f'{n_stuck} stuck walkers')
+        for key, value in (('median', p50), ('p16', p16), ('p84', p84)):
+            bad = np.abs(value - np.array(ref[key])) > scale
+            failures += [f'{key} of {n}' for n in np.array(
+                model.param_names)[bad]]
+        if truth is not None:
+            bad = (truth < p2) | (truth > p97)
+            failures += [f'truth of {n}' for n in np.array(
+                model.param_names)[bad]]
+
+        report[name] = {'passed': not failures,
+                        'failures': failures,
+                        'median': p50,
+                        'p16': p16,
+                        'p84': p84,
+                        'n_stuck': n_stuck,
+                        'time': elapsed,
+                        'ess_per_sec': ess_per_sec,
+                        }
+        if verbose:
+            status = 'ok' if not failures else 'FAILED: ' + ', '.join(failures)
+            print(f'{name}: {elapsed:.1f} s, {ess_per_sec:.0f} ESS/s, '
+                  f'{n_stuck} of {walkers.size} walkers stuck, {status}')
+
+    failed = [k for k, v in report.items() if not v['passed']]
+    if failed and raise_on_failure:
+        raise AssertionError(f'Regression cases failed: {", ".join(failed)}')
+    return report
+
+
+def _hung_task(task_id, payload):
+    """A task function standing in for a hung fit. """
+    time.sleep(3)
+    return fit_task(task_id, payload)
+
+
+def run_distributed_test(verbose=True):
+    """Checks on a single machine that lost tasks are requeued.
+
+    A Coordinator and worker threads share a SQLite queue of three small
+    inversions. One task is claimed by a worker that dies, and another by a
+    worker that hangs past its deadline. Both must be requeued and completed
+    by a healthy worker, with the seed of their spectrum. A lost task
+    without attempts left must be marked as failed.
+
+    Args:
+        verbose (:obj:`bool`): Whether to print the results. Defaults to
+            True.
+
+    Raises:
+        AssertionError: If a check fails.
+
+    """
+    fp = os.path.join(os.path.dirname(bisip.__file__), 'data/SIP-K389175.dat')
+    payload = {'filepath': fp, 'model': 'PeltonColeCole',
+               'model_kwargs': {'nwalkers': 16, 'nsteps': 200}}
+    with tempfile.TemporaryDirectory() as tmp:
+        transport = SQLiteTransport(os.path.join(tmp, 'queue.db'))
+        coordinator = Coordinator(transport, heartbeat_timeout=0.5,
+                                  max_attempts=2, seed=0)
+        coordinator.submit({k: payload for k in ('A', 'B', 'C')})
+        # A worker dies after claiming a task
+        transport.claim('dead-worker')
+        # A worker hangs on a task past its deadline
+        hung = Worker(transport, task_fn=_hung_task, heartbeat_interval=0.1,
+                      task_timeout=0.3)
+        threads = [threading.Thread(target=hung.run, kwargs={'max_tasks': 1})]
+        threads[0].start()
+        while transport.counts().get('running', 0) < 2:
+            time.sleep(0.05)
+        healthy = Worker(transport, heartbeat_interval=0.1)
+        processed = []
+        threads.append(threading.Thread(
+            target=lambda: processed.append(healthy.run(wait=2))))
+        threads[1].start()
+        counts = coordinator.monitor(poll=0.2, timeout=60)
+        for t in threads:
+            t.join()
+        results = coordinator.results()
+        assert counts == {'done': 3}, counts
+        assert processed == [3], processed
+        seeds = {k: r['seed'] for k, r in results.items()}
+        assert len({str(v) for v in seeds.values()}) == 3, seeds
+
+        # Lost tasks without attempts left are failed
+        transport = SQLiteTransport(os.path.join(tmp, 'failed.db'))
+        coordinator = Coordinator(transport, heartbeat_timeout=0.2,
+                                  max_attempts=1)
+        coordinator.submit({'A': payload})
+        transport.claim('dead-worker')
+        counts = coordinator.monitor(poll=0.1, timeout=10)
+        assert counts == {'failed': 1}, counts
+
+    if verbose:
+        print('Distributed inversion: ok')
+
+
+async def _service_session():
+    """Runs a client session against an InversionService socket. """
+    fp = os.path.join(os.path.dirname(bisip.__file__), 'data/SIP-K389175.dat')
+    data = np.loadtxt(fp, skiprows=1, delimiter=',').tolist()
+    service = InversionService('PeltonColeCole', max_workers=1, seed=0,
+                               model_kwargs={'nwalkers': 16, 'nsteps': 300},
+                               progress_every=100)
+    async with service:
+        server = await service.serve(port=0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        # The second job waits behind the first one on the single worker,
+        # and the duplicate of the first one is rejected
+        for request in ({'id': 'A', 'data': data},
+                        {'id': 'B', 'data': data},
+                        {'id': 'A', 'data': data},
+                        {'cancel': 'B'}):
+            writer.write((json.dumps(request) + '\n').encode())
+        await writer.drain()
+        writer.write_eof()
+        events = [json.loads(line) async for line in reader]
+        writer.close()
+        server.close()
+        await server.wait_closed()
+    return events
+
+
+def run_service_test(verbose=True):
+    """Checks the socket protocol of the inversion service.
+
+    A client submits two spectra over a local socket, resubmits the first
+    one while it is still running and cancels the queued second one. The
+    first job must stream its progress and final summary, the duplicate
+    must be rejected and the second job must be cancelled.
+
+    Args:
+        verbose (:obj:`bool`): Whether to print the results. Defaults to
+            True.
+
+    Raises:
+        AssertionError: If a check fails.
+
+    """
+    events = asyncio.run(_service_session())
+    final = {}
+    for e in events:
+        if e['status'] in ('done', 'cancelled', 'failed'):
+            final.setdefault(e['job_id'], []).append(e)
+    assert [e['status'] for e in final['A']] == ['failed', 'done'], final
+    assert 'Duplicate' in final['A'][0]['error'], final['A'][0]
+    assert [e['status'] for e in final['B']] == ['cancelled'], final
+    progress = [e['step'] for e in events
+                if e['job_id'] == 'A' and e['status'] == 'running']
+    assert progress == [100, 200, 300], progress
+    assert len(final['A'][1]['mean']) == 4, final['A'][1]
+
+    if verbose:
+        print('Inversion service: ok')
@@ -7,14 +7,106 @@
 # @Last modified time: 2020-03-19T10:56:14-04:00
 
 
+import hashlib
 import warnings
 
 import numpy as np
 
 
+class _Digest(object):
+    """A merging t-digest to estimate quantiles of a stream of samples.
+
+    Samples are merged into weighted centroids which are small near the
+    extreme quantiles and large near the median, so the tails of the
+    distribution are accurately resolved with a bounded memory footprint.
+
+    """
+
+    def __init__(self, compression=200):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.min = np.inf
+        self.max = -np.inf
+
+    def _k(self, q):
+        return self.compression/(2*np.pi)*np.arcsin(2*np.clip(q, 0, 1) - 1)
+
+    def update(self, x):
+        """Merges an array of samples in the digest. """
+        self.min = min(self.min, x.min())
+        self.max = max(self.max, x.max())
+        means = np.concatenate([self.means, x])
+        weights = np.concatenate([self.weights, np.ones(x.shape[0])])
+        order = np.argsort(means, kind='mergesort')
+        means, weights = means[order], weights[order]
+
+        # Group consecutive centroids spanning less than one unit of k-scale
+        cum = np.cumsum(weights)
+        q = (cum - weights/2) / cum[-1]
+        groups = np.floor(self._k(q) - self._k(0)).astype(int)
+        starts = np.flatnonzero(np.r_[True, np.diff(groups) > 0])
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(weights*means, starts) / self.weights
+
+    def percentile(self, p):
+        """Estimates percentiles (between 0 and 100) of the samples. """
+        cum = np.cumsum(self.weights)
+        centers = np.r_[0, cum - self.weights/2, cum[-1]]
+        values = np.r_[self.min, self.means, self.max]
+        return np.interp(np.asarray(p)/100*cum[-1], centers, values)
+
+
+def seed_sequence(seed=None):
+    """Converts a seed to a `numpy.random.SeedSequence`.
+
+    Args:
+        seed: An int, a SeedSequence, a dict with `entropy` and `spawn_key`
+            keys (as recorded by the `seed` property of the models) or None
+            for fresh entropy from the operating system.
+
+    Returns:
+        :obj:`SeedSequence`: The seed sequence.
+
+    """
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    if isinstance(seed, dict):
+        return np.random.SeedSequence(seed['entropy'],
+                                      spawn_key=tuple(seed['spawn_key']))
+    return np.random.SeedSequence(seed)
+
+
+def spectrum_seed(seed, spectrum_id):
+    """Derives the seed of a spectrum in a batch from the batch seed.
+
+    The seed of a spectrum only depends on the batch seed and on the
+    spectrum ID, and not on the worker or on the order in which the spectra
+    are processed, so a rerun of a batch or of a failed shard reproduces
+    the same results.
+
+    Args:
+        seed: The seed of the batch (see `seed_sequence`).
+        spectrum_id: An int or str identifying the spectrum.
+
+    Returns:
+        :obj:`SeedSequence`: The seed sequence of the spectrum.
+
+    """
+    ss = seed_sequence(seed)
+    if isinstance(spectrum_id, (int, np.integer)) and spectrum_id >= 0:
+        key = int(spectrum_id)
+    else:
+        digest = hashlib.sha256(str(spectrum_id).encode()).digest()
+        key = int.from_bytes(digest[:8], 'little')
+    return np.random.SeedSequence(ss.entropy,
+                                  spawn_key=ss.spawn_key + (key,))
+
+
 class utils(object):
 
-    def get_model_percentile(self, p=[2.5, 50, 97.5], chain=None, **kwargs):
+    def get_model_percentile(self, p=[2.5, 50, 97.5], chain=None,
+                             chunk_size=None, **kwargs):
         """Gets percentiles of the model values for a MCMC chain.
 
         Args:
@@ -24,15 +116,34 @@ class utils(object):
                 plot. Should be a 2D array (nsteps, ndim). If None and no
                 kwargs are passed to discard iterations, will raise a warning
                 and the full chain will be used. Defaults to None.
+            chunk_size (:obj:`int`): The number of samples passed at once to
+                the forward_batch method. If None, the `chunk_size` attribute
+                is used. Defaults to None.
+
+        When `chain` is None, the percentiles are cached until the model is
+        fitted again, so repeated plotting calls are cheap.
 
         Keyword Args:
             **kwargs: See kwargs of the get_chain method.
         """
+        # Percentiles of the full chain are cached until the next fit
+        key = None
+        if chain is None:
+            key = (tuple(np.atleast_1d(p)), tuple(sorted(kwargs.items())))
+            if key in self._percentile_cache:
+                return self._percentile_cache[key]
+
         chain = self.parse_chain(chain, **kwargs)
+        chunk_size = chunk_size or self.chunk_size
         results = np.empty((chain.shape[0], 2, self.data['N']))
-        for i in range(chain.shape[0]):
-            results[i] = self.forward(chain[i], self.data['w'])
-        return np.percentile(results, p, axis=0)
+        for i in range(0, chain.shape[0], chunk_size):
+            results[i:i+chunk_size] = self.forward_batch(
+                chain[i:i+chunk_size], self.data['w'])
+        percentiles = np.percentile(results, p, axis=0)
+
+        if key is not None:
+            self._percentile_cache[key] = percentiles
+        return percentiles
 
     def get_param_percentile(self, p=[2.5, 50, 97.5], chain=None, **kwargs):
         """Gets percentiles of the parameter values for a MCMC chain.
@@ -45,10 +156,19 @@ class utils(object):
                 kwargs are passed to discard iterations, will raise a warning
                 and the full chain will be used. Defaults to None.
 
+        When `chain` is None, the stored chain is read in chunks and the
+        percentiles are estimated with a t-digest, like `get_param_summary`,
+        instead of being computed exactly from a flattened copy.
+
         Keyword Args:
             **kwargs: See kwargs of the get_chain method.
 
         """
+        if chain is None:
+            kwargs.pop('flat', None)
+            self._warn_if_not_discarded(kwargs)
+            percentile = self.get_param_summary(p=p, **kwargs)['percentile']
+            return percentile if np.ndim(p) else percentile[0]
         chain = self.parse_chain(chain, **kwargs)
         return np.percentile(chain, p, axis=0)
 
@@ -65,6 +185,8 @@ class utils(object):
             **kwargs: See kwargs of the get_chain method.
 
         """
+        if chain is None:
+            return self._stream_moments(**kwargs)[0]
         chain = self.parse_chain(chain, **kwargs)
         return np.mean(chain, axis=0)
 
@@ -81,19 +203,89 @@ class utils(object):
             **kwargs: See kwargs of the get_chain method.
 
         """
+        if chain is None:
+            return self._stream_moments(**kwargs)[1]
         chain = self.parse_chain(chain, **kwargs)
         return np.std(chain, axis=0)
 
+    def _stream_moments(self, **kwargs):
+        """Returns the mean and standard deviation of the stored chain. """
+        kwargs.pop('flat', None)
+        self._warn_if_not_discarded(kwargs)
+        summary = self.get_param_summary(p=[], **kwargs)
+        return summary['mean'], summary['std']
+
+    def get_param_summary(self, p=[2.5, 50, 97.5], discard=0, thin=1,
+                          chunk_size=1000, compression=200):
+        """Gets the mean, standard deviation and percentiles in one pass.
+
+        The stored chain is read in chunks without being flattened or copied
+        as a whole. The mean and variance are accumulated exactly with
+        Welford's algorithm, and the percentiles are estimated with a
+        t-digest, which is accurate to a small fraction of the standard
+        deviation for unimodal posteriors. Increase `compression` if a
+        percentile falls in a gap between two modes.
+
+        Args:
+            p (:obj:`float` or :obj:`list` of :obj:`float`): percentiles values
+                to compute. Defaults to [2.5, 50, 97.5].
+            discard (:obj:`int`): Number of steps to discard (burn-in period).
+                Defaults to 0.
+            thin (:obj:`int`): Thinning factor. Defaults to 1.
+            chunk_size (:obj:`int`): The number of steps read at once.
+                Defaults to 1000.
+            compression (:obj:`int`): The compression factor of the t-digest.
+                Larger values are more accurate and use more memory.
+                Defaults to 200.
+
+        Returns:
+            :obj:`dict`: A dict holding the `mean`, `std` and `percentile`
+            arrays of the parameters, and the number of samples `n`.
+
+        """
+        n = 0
+        mean = M2 = 0
+        digests = None
+        p = np.atleast_1d(p)
+        for chunk in self.iter_chain(chunk_size, discard=discard, thin=thin):
+            # Chan et al. (1979) update of the Welford accumulators
+            n_b = chunk.shape[0]
+            mean_b = chunk.mean(axis=0)
+            M2_b = np.sum((chunk - mean_b)**2, axis=0)
+            delta = mean_b - mean
+            mean = mean + delta*n_b/(n + n_b)
+            M2 = M2 + M2_b + delta**2*n*n_b/(n + n_b)
+            n += n_b
+
+            if len(p):
+                if digests is None:
+                    digests = [_Digest(compression)
+                               for _ in range(chunk.shape[1])]
+                for d, x in zip(digests, chunk.T):
+                    d.update(x)
+
+        percentile = np.empty((len(p), np.size(mean)))
+        if digests is not None:
+            percentile = np.array([d.percentile(p) for d in digests]).T
+        return {'mean': mean,
+                'std': np.sqrt(M2/n),
+                'percentile': percentile,
+                'n': n,
+                }
+
+    def _warn_if_not_discarded(self, kwargs):
+        if 'discard' not in kwargs and 'thin' not in kwargs:
+            warnings.warn(('No samples were discarded from the chain.\n'
+                           'Pass discard and thin keywords to remove '
+                           'burn-in samples and reduce autocorrelation.'),
+                          UserWarning)
+
     def parse_chain(self, chain, **kwargs):
         if chain is None:
             # if discard is not None and thin is not None:
             kwargs['flat'] = True
             chain = self.get_chain(**kwargs)
-            if 'discard' not in kwargs and 'thin' not in kwargs:
-                warnings.warn(('No samples were discarded from the chain.\n'
-                               'Pass discard and thin keywords to remove '
-                               'burn-in samples and reduce autocorrelation.'),
-                              UserWarning)
+            self._warn_if_not_discarded(kwargs)
         else:
             if chain.ndim > 2:
                 raise ValueError('Flatten chain by passing flat=True.')
@@ -109,15 +301,21 @@ class utils(object):
         """Imports a data file and prepares it for inversion.
 
         Args:
-            filepath (:obj:`str`): The path to the data file.
+            filepath (:obj:`str` or :obj:`ndarray`): The path to the data
+                file, or an array with the same columns as the data file
+                (freq, amp, pha, amp_err, pha_err) for in-memory data.
             headers (:obj:`int`): The number of header lines in the file.
-                Defaults to 1.
+                Ignored for in-memory data. Defaults to 1.
             ph_units (:obj:`str`): The units of the phase shift measurements.
                 Choices: 'mrad', 'rad', 'deg'. Defaults to 'mrad'.
 
         """
-        # Importation des données .DAT
-        dat_file = np.loadtxt(f'{filename}', skiprows=headers, delimiter=',')
+        if isinstance(filename, np.ndarray):
+            dat_file = filename.astype(float)
+        else:
+            # Importation des données .DAT
+            dat_file = np.loadtxt(f'{filename}', skiprows=headers,
+                                  delimiter=',')
         labels = ['freq', 'amp', 'pha', 'amp_err', 'pha_err']
         data = {l: dat_file[:, i] for (i, l) in enumerate(labels)}
 